@@ -0,0 +1,415 @@
+import json
+import time
+
+from .blocks import BlockIndex
+from .coalesce import Coalescer
+from .messages import BlockUpdate, Transaction
+from .pending import TIMEOUT, CANCELLED
+from .protocol import Protocol, OPEN, ERROR, OUT_OF_FUEL, TRANSACT, BLOCK_UPDATE, EVENT
+
+# Most blocks kept in client.blocks before the least recently used are dropped
+BLOCK_CAPACITY = 65536
+
+
+class BaseClient:
+    """
+    Shared front-end over `Protocol`: event handlers, message dispatch and the write actions.
+    Subclasses supply the transport (`login`, `disconnect`) and the read actions.
+    """
+    def __init__(self, token, ledger=None, pending=None):
+        self.protocol = Protocol(token, pending)
+
+        # Event manager
+        self.events = {}
+
+        # Last frame sent, resent on out of fuel
+        self.queue = None
+
+        # Requests waiting on a reply, by nonce
+        self.pending = self.protocol.pending
+
+        # Default seconds to wait for a reply, None to wait forever
+        self.timeout = None
+
+        # Known block state, kept current from block updates and our own reads and writes
+        self.blocks = BlockIndex(BLOCK_CAPACITY)
+
+        # Identical reads in flight share one request, see replcraft.coalesce
+        self.reads = Coalescer(pending=self.pending)
+
+        # Transaction ledger (optional), see replcraft.ledger
+        self.ledger = ledger
+
+        # Outbound scheduler (optional), see replcraft.scheduler
+        self.scheduler = None
+
+        # Background sender, started on login, see replcraft.writer
+        self.writer = None
+
+        # Functions called with every BlockUpdate, alongside the block update handler
+        self.watchers = []
+
+    @property
+    def nonce(self):
+        return self.protocol.nonce
+
+    @property
+    def token(self):
+        return self.protocol.token
+
+    @property
+    def config(self):
+        return self.protocol.config
+
+    # Events
+    def on(self, event: str):
+        """
+        Add function to event
+                Parameters:
+                    event (str): Event manager
+                Returns:
+                    decorator
+        """
+        def decorator(func):
+            self.events[event] = func
+            def wrapper(*args, **kwargs):
+                result = func(*args, **kwargs)
+                return result
+            return wrapper
+        return decorator
+
+    def _event(self, event: str):
+        return self.events.get(event, False)
+
+    # Private Send Function
+    # With a callback, the reply is handed to it instead of the event handlers
+    def _send(self, data, callback=None):
+        if callback:
+            frame, request = self.protocol.request(data, self._track(data, callback))
+        else:
+            frame = self.protocol.prepare(data)
+        self._transmit(frame)
+        self.queue = frame
+
+    # Send a request that waits on a reply
+    def _request(self, data, callback=None, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        frame, request = self.protocol.request(data, self._track(data, callback), timeout)
+        self._transmit(frame)
+        return request
+
+    # Writes that wait on a reply keep the read cache and block index current:
+    # reads of the blocks involved are dropped when the write is sent,
+    # and the index only takes the new block once the server confirms it
+    def _track(self, data, callback):
+        if data.get('action') != 'set_block':
+            return callback
+        x, y, z = data['x'], data['y'], data['z']
+        self.reads.invalidate(x, y, z)
+        self.reads.invalidate(data.get('source_x'), data.get('source_y'), data.get('source_z'))
+        self.reads.invalidate(data.get('target_x'), data.get('target_y'), data.get('target_z'))
+
+        def placed(reply):
+            if reply.get('ok') is not False:
+                self.blocks.update(x, y, z, data['blockData'])
+            else:
+                self.blocks.remove(x, y, z)
+            if callback:
+                callback(reply)
+        return placed
+
+    # Resend Function
+    def _resend(self, frame):
+        self._transmit(frame)
+
+    def _transmit(self, frame):
+        if self.scheduler:
+            self.scheduler.submit(frame)
+        else:
+            self._write(frame)
+
+    # Put a frame on the wire, through the writer thread once logged in
+    def _write(self, frame):
+        if self.writer:
+            self.writer.put(frame)
+        else:
+            self.ws.send(json.dumps(frame))
+
+    # Answer a transaction
+    def _respond(self, queryNonce, accept):
+        self._send(self.protocol.respond(queryNonce, accept))
+
+    # Event Listener
+    # `received` is when the message came off the wire, defaulting to now
+    def _dispatch(self, msg, kinds, received=None):
+        for kind in kinds:
+            if kind == OPEN:
+                if OPEN in self.events:
+                    self.events[OPEN](self)
+
+            elif kind == OUT_OF_FUEL:
+                if OUT_OF_FUEL in self.events:
+                    if self.queue:
+                        self._resend(self.queue)
+                    self.events[OUT_OF_FUEL](self, msg)
+
+            elif kind == ERROR:
+                if ERROR in self.events:
+                    self.events[ERROR](self, msg.get('error'), msg)
+
+            elif kind == BLOCK_UPDATE:
+                update = BlockUpdate(msg, time.monotonic() if received is None else received)
+                # Keep the block index current
+                self.blocks.update(update.x, update.y, update.z, update.block)
+                self.reads.invalidate(update.x, update.y, update.z)
+                for watcher in list(self.watchers):
+                    watcher(update)
+                if BLOCK_UPDATE in self.events:
+                    self.events[BLOCK_UPDATE](self, update.cause, update.block, update.x, update.y, update.z)
+
+            elif kind == TRANSACT:
+                if TRANSACT in self.events:
+                    self._transact(msg)
+
+            elif kind == EVENT:
+                if EVENT in self.events:
+                    self.events[EVENT](self, msg['event'], msg['cause'], msg['block'], msg['x'], msg['y'], msg['z'])
+
+    # Transaction Handling
+    def _transact(self, msg):
+        queryNonce = msg['queryNonce']
+
+        # Redelivered transactions are answered from the ledger instead of being handled twice
+        if self.ledger:
+            outcome = self.ledger.outcome(queryNonce)
+            if outcome is not None:
+                return self._respond(queryNonce, outcome)
+            self.ledger.receive(msg)
+
+        # Run event listener
+        self.events[TRANSACT](self, Transaction(msg, self))
+
+    # Answer a transaction, logging the answer first
+    def _settle(self, queryNonce, accept):
+        if self.ledger:
+            self.ledger.resolve(queryNonce, accept)
+        self._respond(queryNonce, accept)
+
+    #
+    # Tell & Pay Functions
+    #
+
+    def tell(self, target: str, message: str):
+        """
+        Send a message to a player inside a structure
+                Parameters:
+                    target (str): Player Name or UUID
+                    message (str): Message to send to player
+                Returns:
+                    None
+        """
+        self._send(self.protocol.tell(target, message))
+
+    def pay(self, target: str, amount: str):
+        """
+        Send money to a player.
+                Parameters:
+                    target (str): Player Name or UUID
+                    amount (str): Amount of money to send to player
+                Returns:
+                    None
+        """
+        self._send(self.protocol.pay(target, amount))
+
+    #
+    # Block Functions
+    # From bobbypin's ReplCraftPy library
+    #
+
+    def setBlock(self, x, y, z, blockdata,
+                 source_x=None, source_y=None, source_z=None,
+                 target_x=None, target_y=None, target_z=None
+            ):
+        """
+        Sets a block at the given structure-local coordinates.
+        The block must be available in the specified source chest or the structure inventory.
+        Any block replaced by this call is stored in the specified target chest or the structure inventory, or dropped in the world if there's no space.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                    blockdata (str): Blockdata
+                    **source_x (int): The X coordinate of the container the block to set is in.
+                    **source_y (int): The Y coordinate of the container the block to set is in.
+                    **source_z (int): The Z coordinate of the container the block to set is in.
+                    **target_x (int): The X coordinate of the container the block replaced should go to.
+                    **target_y (int): The Y coordinate of the container the block replaced should go to.
+                    **target_z (int): The Z coordinate of the container the block replaced should go to.
+                Returns:
+                    None
+        """
+        frame = self.protocol.setBlock(
+            x, y, z, blockdata,
+            source_x, source_y, source_z,
+            target_x, target_y, target_z
+        )
+
+        # The block index is updated by _track; failures go to the event handlers
+        def failed(reply):
+            if reply.get('ok') is not False:
+                return
+            if reply.get('error') == 'out of fuel':
+                # The out of fuel handler resends the last frame; if that is this one, wait on it again
+                if OUT_OF_FUEL in self.events and self.queue and self.queue['nonce'] == reply.get('nonce'):
+                    self.pending.add(reply['nonce'], self._track(frame, failed))
+                self._dispatch(reply, [OUT_OF_FUEL])
+            elif reply.get('error') not in (TIMEOUT, CANCELLED):
+                self._dispatch(reply, [ERROR])
+
+        self._send(frame, failed)
+
+    def setSignText(self, x, y, z, lines):
+        """
+        Sets the text of a sign at the given coordinates.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                    lines (list): Lines to set
+                Returns:
+                    None
+        """
+        self.reads.invalidate(x, y, z)
+
+        self._send(self.protocol.setSignText(x, y, z, lines))
+
+    def watch(self, x, y, z):
+        """
+        Begins watching a block for updates.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                Returns:
+                    None
+        """
+        self._send(self.protocol.watch(x, y, z))
+
+    def unwatch(self, x, y, z):
+        """
+        Stops watching a block for updates.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                Returns:
+                    None
+        """
+        self._send(self.protocol.unwatch(x, y, z))
+
+    # Begins watching all blocks in the structure for updates.
+    def watchAll(self):
+        self._send(self.protocol.watchAll())
+
+    # Stops watching all blocks for updates.
+    def unwatchAll(self):
+        self._send(self.protocol.unwatchAll())
+
+    # Begins polling all blocks in the structure for updates.
+    # Updates will be very slow!
+    def pollAll(self):
+        self._send(self.protocol.pollAll())
+
+    # Stops polling all blocks in the structure.
+    def unpollAll(self):
+        self._send(self.protocol.unpollAll())
+
+    # Begins polling a block for updates.
+    # Note that this catches all possible block updates, but only one block is polled per tick.
+    # The more blocks you poll, the slower each individual block will be checked.
+    # Additionally, if a block changes multiple times between polls, only the latest change
+    # will be reported.
+    def poll(self, x, y, z):
+        self._send(self.protocol.poll(x, y, z))
+
+    # Stops polling a block for updates.
+    def unpoll(self, x, y, z):
+        self._send(self.protocol.unpoll(x, y, z))
+
+    # Moves an item between containers.
+    def moveItem(self, index,
+            source_x, source_y, source_z,
+            target_x, target_y, target_z,
+            amount=None, target_index=None
+        ):
+        self.reads.invalidate(source_x, source_y, source_z)
+        self.reads.invalidate(target_x, target_y, target_z)
+
+        self._send(self.protocol.moveItem(
+            index,
+            source_x, source_y, source_z,
+            target_x, target_y, target_z,
+            amount, target_index
+        ))
+
+    # Crafts an item, which is then stored into the given container.
+    def craft(self, x, y, z, recipe):
+        self.reads.invalidate(x, y, z)
+
+        self._send(self.protocol.craft(x, y, z, recipe))
+
+    # Index of an item withing a container.
+    #
+    # :index: index of the slot the time is in within the container.
+    # :x, y, z: the coordinates of the container.
+    class ItemIndex:
+        __slots__ = ('index', 'x', 'y', 'z')
+
+        def __init__(self, index, x, y, z):
+            self.index = index # The index of the chest slot the item is in.
+            self.x = x
+            self.y = y
+            self.z = z
+
+        def item(self):
+            return {
+                    "index": self.index,
+                    "x": self.x,
+                    "y": self.y,
+                    "z": self.z
+                }
+
+    # Recipe, matching it's vanilla definition
+    #
+    # :s1-s9: crafting table slots
+    class Recipe:
+        __slots__ = ('s1', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9')
+
+        def __init__(self,
+            s1=None,
+            s2=None,
+            s3=None,
+            s4=None,
+            s5=None,
+            s6=None,
+            s7=None,
+            s8=None,
+            s9=None
+        ):
+            self.s1 = s1
+            self.s2 = s2
+            self.s3 = s3
+            self.s4 = s4
+            self.s5 = s5
+            self.s6 = s6
+            self.s7 = s7
+            self.s8 = s8
+            self.s9 = s9
+
+        def table(self):
+            return [
+                    self.s1, self.s2, self.s3,
+                    self.s4, self.s5, self.s6,
+                    self.s7, self.s8, self.s9
+                ]
@@ -0,0 +1,163 @@
+import threading
+from fnmatch import fnmatchcase
+
+from .build import AIR
+from .cache import BoundedStore
+from .entities import SpatialGrid
+from .parse import blockType
+
+# Block types that getInventory and moveItem work with
+CONTAINERS = {
+    'minecraft:chest', 'minecraft:trapped_chest', 'minecraft:barrel',
+    'minecraft:hopper', 'minecraft:dispenser', 'minecraft:dropper',
+    'minecraft:furnace', 'minecraft:blast_furnace', 'minecraft:smoker',
+    'minecraft:brewing_stand'
+}
+
+
+def _pattern(pattern):
+    return pattern if ':' in pattern else 'minecraft:' + pattern
+
+
+class BlockIndex:
+    """
+    Known block state of a structure, indexed by position and by block type.
+    Positions live in a `BoundedStore`; with a `capacity`, blocks are evicted by `policy`
+    and drop out of the type and region indexes with them. Air is remembered but not indexed.
+    Type patterns may omit the `minecraft:` namespace and use shell-style wildcards, e.g. `*_sign`.
+    Safe to use from several threads, such as an event loop and the threads making writes.
+    """
+    def __init__(self, capacity=None, policy='lru'):
+        self.blocks = BoundedStore(capacity, policy, self._untype) # (x, y, z) -> blockdata
+        self.types = {} # block type -> set of (x, y, z)
+        self.grid = SpatialGrid(16) # positions of the indexed blocks, by region
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def get(self, x, y, z):
+        """
+        Known block data at a position, None if unknown.
+        """
+        with self._lock:
+            return self.blocks.get((x, y, z))
+
+    def update(self, x, y, z, blockdata):
+        """
+        Record the block at a position.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                    blockdata (str): Block data
+        """
+        pos = (x, y, z)
+        with self._lock:
+            previous = self.blocks[pos] if pos in self.blocks else None
+            if previous is not None:
+                self._untype(pos, previous)
+            self.blocks[pos] = blockdata
+            if blockType(blockdata) not in AIR:
+                self.types.setdefault(blockType(blockdata), set()).add(pos)
+                self.grid.insert(pos, x, y, z)
+
+    def remove(self, x, y, z):
+        """
+        Forget the block at a position.
+        """
+        with self._lock:
+            previous = self.blocks.pop((x, y, z))
+            if previous is not None:
+                self._untype((x, y, z), previous)
+
+    # Called with the lock held, also when the store evicts a block
+    def _untype(self, pos, blockdata):
+        self.grid.remove(pos)
+        block = blockType(blockdata)
+        positions = self.types.get(block)
+        if not positions:
+            return
+        positions.discard(pos)
+        if not positions:
+            del self.types[block]
+
+    def stats(self):
+        """
+        Hit, miss and eviction counters of the position store.
+        """
+        with self._lock:
+            return self.blocks.stats()
+
+    def _matching(self, pattern):
+        pattern = _pattern(pattern)
+        if pattern in self.types:
+            return [self.types[pattern]]
+        if not any(c in pattern for c in '*?['):
+            return []
+        return [positions for block, positions in self.types.items() if fnmatchcase(block, pattern)]
+
+    def find(self, pattern):
+        """
+        Positions of every known block of a type.
+                Parameters:
+                    pattern (str): Block type or wildcard pattern
+                Returns:
+                    set of (x, y, z)
+        """
+        found = set()
+        with self._lock:
+            for positions in self._matching(pattern):
+                found |= positions
+        return found
+
+    def within(self, x1, y1, z1, x2, y2, z2, pattern=None):
+        """
+        Known blocks inside an axis-aligned box, bounds included.
+                Parameters:
+                    x1, y1, z1, x2, y2, z2 (int): Opposite corners of the box
+                    pattern (str): Only blocks of this type, optional
+                Returns:
+                    dict of (x, y, z) -> blockdata
+        """
+        with self._lock:
+            # Only the regions covering the box are visited
+            found = {pos: self.blocks[pos] for pos in self.grid.within(x1, y1, z1, x2, y2, z2)}
+        if pattern:
+            pattern = _pattern(pattern)
+            found = {pos: blockdata for pos, blockdata in found.items() if fnmatchcase(blockType(blockdata), pattern)}
+        return found
+
+    def nearest(self, x, y, z, pattern):
+        """
+        Closest known block of a type.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                    pattern (str): Block type or wildcard pattern
+                Returns:
+                    (x, y, z), or None if there is none
+        """
+        best = None
+        bestDistance = None
+        with self._lock:
+            for positions in self._matching(pattern):
+                for pos in positions:
+                    distance = (pos[0] - x) ** 2 + (pos[1] - y) ** 2 + (pos[2] - z) ** 2
+                    if best is None or distance < bestDistance:
+                        best, bestDistance = pos, distance
+        return best
+
+    def containers(self):
+        """
+        Positions of every known container.
+                Returns:
+                    set of (x, y, z)
+        """
+        found = set()
+        with self._lock:
+            for block, positions in self.types.items():
+                if block in CONTAINERS or block.endswith('shulker_box'):
+                    found |= positions
+        return found
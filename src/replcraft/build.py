@@ -0,0 +1,344 @@
+import json
+import os
+import time
+from collections import Counter
+
+from .parse import blockType
+
+# Block types that are never placed or counted as materials
+AIR = {'minecraft:air', 'minecraft:cave_air', 'minecraft:void_air'}
+
+# Blocks that fall when nothing is under them
+GRAVITY = {
+    'minecraft:sand', 'minecraft:red_sand', 'minecraft:gravel',
+    'minecraft:anvil', 'minecraft:chipped_anvil', 'minecraft:damaged_anvil',
+    'minecraft:dragon_egg', 'minecraft:scaffolding', 'minecraft:pointed_dripstone'
+}
+
+# Blocks that pop off unless the block they hang on is already there
+ATTACHED = {
+    'minecraft:torch', 'minecraft:wall_torch',
+    'minecraft:soul_torch', 'minecraft:soul_wall_torch',
+    'minecraft:redstone_torch', 'minecraft:redstone_wall_torch',
+    'minecraft:redstone_wire', 'minecraft:repeater', 'minecraft:comparator',
+    'minecraft:lever', 'minecraft:ladder', 'minecraft:vine',
+    'minecraft:tripwire', 'minecraft:tripwire_hook',
+    'minecraft:rail', 'minecraft:powered_rail', 'minecraft:detector_rail', 'minecraft:activator_rail',
+    'minecraft:snow', 'minecraft:lantern', 'minecraft:soul_lantern'
+}
+ATTACHED_SUFFIXES = ('_button', '_pressure_plate', '_sign', '_carpet', '_door', '_banner')
+
+# Blocks whose item has a different name
+ITEMS = {
+    'minecraft:wall_torch': 'minecraft:torch',
+    'minecraft:soul_wall_torch': 'minecraft:soul_torch',
+    'minecraft:redstone_wall_torch': 'minecraft:redstone_torch',
+    'minecraft:redstone_wire': 'minecraft:redstone',
+    'minecraft:tripwire': 'minecraft:string'
+}
+
+
+def itemType(blockdata):
+    """
+    Name of the item consumed when placing the given block.
+            Parameters:
+                blockdata (str): Block data
+            Returns:
+                str
+    """
+    block = blockType(blockdata)
+    if block in ITEMS:
+        return ITEMS[block]
+    if block.endswith('_wall_sign') or block.endswith('_wall_banner'):
+        return block.replace('_wall_', '_')
+    return block
+
+
+def tier(blockdata):
+    """
+    Placement tier of a block: 0 for solid blocks, 1 for gravity blocks and 2 for attached blocks.
+            Parameters:
+                blockdata (str): Block data
+            Returns:
+                int
+    """
+    block = blockType(blockdata)
+    if block in ATTACHED or block.endswith(ATTACHED_SUFFIXES):
+        return 2
+    if block in GRAVITY or block.endswith('_concrete_powder'):
+        return 1
+    return 0
+
+
+class Schematic:
+    """
+    Target block grid, keyed by structure-local (x, y, z) coordinates.
+    Positions missing from the grid are left as they are.
+    """
+    def __init__(self, blocks=None):
+        self.blocks = dict(blocks or {})
+
+    @classmethod
+    def fromPalette(cls, palette, grid, origin=(0, 0, 0)):
+        """
+        Build a schematic from a palette and a grid of palette indices.
+                Parameters:
+                    palette (list): Block data for each index
+                    grid (list): Indices nested as grid[y][z][x], None or -1 to skip a position
+                    origin (tuple): Structure-local coordinates of grid[0][0][0]
+                Returns:
+                    Schematic
+        """
+        ox, oy, oz = origin
+        blocks = {}
+        for y, layer in enumerate(grid):
+            for z, row in enumerate(layer):
+                for x, index in enumerate(row):
+                    if index is None or index < 0:
+                        continue
+                    blocks[(ox + x, oy + y, oz + z)] = palette[index]
+        return cls(blocks)
+
+    @classmethod
+    def load(cls, path, origin=(0, 0, 0)):
+        """
+        Load a JSON schematic file.
+        The file holds either {"palette": [...], "grid": [[[...]]]} or {"blocks": {"x,y,z": blockdata}}.
+                Parameters:
+                    path (str): File to read
+                    origin (tuple): Structure-local coordinates of the schematic origin
+                Returns:
+                    Schematic
+        """
+        with open(path) as f:
+            data = json.load(f)
+
+        if 'palette' in data:
+            return cls.fromPalette(data['palette'], data['grid'], origin)
+
+        ox, oy, oz = origin
+        blocks = {}
+        for key, blockdata in data['blocks'].items():
+            x, y, z = (int(n) for n in key.split(','))
+            blocks[(ox + x, oy + y, oz + z)] = blockdata
+        return cls(blocks)
+
+    def diff(self, current):
+        """
+        Blocks that differ from the current state.
+                Parameters:
+                    current (dict): Current block data keyed by (x, y, z)
+                Returns:
+                    dict
+        """
+        return {
+            pos: blockdata for pos, blockdata in self.blocks.items()
+            if current.get(pos) != blockdata
+        }
+
+
+def materials(changes):
+    """
+    Count the items needed to place a set of blocks.
+            Parameters:
+                changes (dict): Block data keyed by (x, y, z)
+            Returns:
+                Counter
+    """
+    return Counter(
+        itemType(blockdata) for blockdata in changes.values()
+        if blockType(blockdata) not in AIR
+    )
+
+
+def order(changes, current=None):
+    """
+    Order block changes so every block is placed after what it rests on.
+    Removals come first, attached blocks before their supports and top-down so nothing falls;
+    then solid blocks, gravity blocks and attached blocks, each bottom-up.
+            Parameters:
+                changes (dict): Block data keyed by (x, y, z)
+                current (dict): Current block data keyed by (x, y, z)
+            Returns:
+                list of ((x, y, z), blockdata)
+    """
+    current = current or {}
+    removals = []
+    placements = []
+    for pos, blockdata in changes.items():
+        if blockType(blockdata) in AIR:
+            removals.append((-tier(current.get(pos, 'minecraft:air')), -pos[1], pos[0], pos[2], pos, blockdata))
+        else:
+            placements.append((tier(blockdata), pos[1], pos[0], pos[2], pos, blockdata))
+
+    removals.sort(key=lambda item: item[:4])
+    placements.sort(key=lambda item: item[:4])
+    return [item[4:] for item in removals + placements]
+
+
+class Builder:
+    """
+    Diffs a schematic against a structure and places the difference through a `jarci2.Client`.
+    Placements are pipelined, paced on out of fuel errors and can be resumed from a progress file.
+    """
+    def __init__(self, client, schematic, window=32, progress=None,
+                 source=None, target=None, backoff=1, maxBackoff=30):
+        self.client = client
+        self.schematic = schematic
+        self.window = window
+
+        # Progress file, one line per coordinate placed so far
+        self.progress = progress
+        self.done = set()
+        self._load()
+
+        # Containers to take blocks from and put replaced blocks in
+        self.source = source
+        self.target = target
+
+        # Out of fuel back-off, in seconds
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+
+    def scan(self):
+        """
+        Read the current state of every position in the schematic.
+                Returns:
+                    dict
+        """
+        positions = list(self.schematic.blocks)
+        replies = self.client.batch(
+            ({"action": "get_block", "x": x, "y": y, "z": z} for x, y, z in positions),
+            self.window
+        )
+        return {
+            pos: reply['block'] for pos, reply in zip(positions, replies)
+            if reply and 'block' in reply
+        }
+
+    def checkMaterials(self, changes, containers):
+        """
+        Compare the items a build needs with the contents of the structure's containers.
+                Parameters:
+                    changes (dict): Block data keyed by (x, y, z)
+                    containers (list): (x, y, z) coordinates of the containers to count
+                Returns:
+                    dict of missing item counts, empty when everything is available
+        """
+        available = Counter()
+        replies = self.client.batch(
+            ({"action": "get_inventory", "x": x, "y": y, "z": z} for x, y, z in containers),
+            self.window
+        )
+        for reply in replies:
+            for item in (reply or {}).get('items', []):
+                available[item['type']] += item['amount']
+
+        needed = materials(changes)
+        return {item: count - available[item] for item, count in needed.items() if available[item] < count}
+
+    def plan(self, current=None):
+        """
+        Ordered placements still needed to reach the schematic.
+                Parameters:
+                    current (dict): Current block data, read with `scan` when omitted
+                Returns:
+                    list of ((x, y, z), blockdata)
+        """
+        if current is None:
+            current = self.scan()
+        changes = {
+            pos: blockdata for pos, blockdata in self.schematic.diff(current).items()
+            if pos not in self.done
+        }
+        return order(changes, current)
+
+    def _frame(self, pos, blockdata):
+        x, y, z = pos
+        frame = {"action": "set_block", "x": x, "y": y, "z": z, "blockData": blockdata}
+        if self.source:
+            frame.update(zip(("source_x", "source_y", "source_z"), self.source))
+        if self.target:
+            frame.update(zip(("target_x", "target_y", "target_z"), self.target))
+        return frame
+
+    # Read the progress file, dropping a torn last line left by a crash
+    def _load(self):
+        if not self.progress or not os.path.exists(self.progress):
+            return
+        good = 0
+        with open(self.progress, 'rb') as f:
+            for line in f:
+                try:
+                    x, y, z = json.loads(line)
+                except (ValueError, TypeError):
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                self.done.add((x, y, z))
+                good += len(line)
+        if good != os.path.getsize(self.progress):
+            with open(self.progress, 'r+b') as f:
+                f.truncate(good)
+
+    # Append the positions placed by one window, so saving costs the same however far the build is
+    def _save(self, placed):
+        if not self.progress or not placed:
+            return
+        with open(self.progress, 'a') as f:
+            f.write(''.join(json.dumps(list(pos), separators=(',', ':')) + '\n' for pos in placed))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def run(self, placements=None):
+        """
+        Place blocks in order, `window` at a time, until the schematic is built.
+        Placements that ran out of fuel are retried after a growing back-off.
+        Once everything is placed the progress is cleared, see `reset`.
+                Parameters:
+                    placements (list): Output of `plan`, computed when omitted
+                Returns:
+                    list of failed placements with their error replies
+        """
+        if placements is None:
+            placements = self.plan()
+
+        failed = []
+        backoff = self.backoff
+        while placements:
+            chunk = placements[:self.window]
+            replies = self.client.batch((self._frame(*p) for p in chunk), self.window)
+
+            retry = []
+            placed = []
+            for placement, reply in zip(chunk, replies):
+                if reply and reply.get('ok') is False:
+                    if reply.get('error') == 'out of fuel':
+                        retry.append(placement)
+                    else:
+                        failed.append((placement, reply))
+                elif placement[0] not in self.done:
+                    self.done.add(placement[0])
+                    placed.append(placement[0])
+            self._save(placed)
+
+            # Keep the original order: anything that ran out of fuel goes first next round
+            placements = retry + placements[len(chunk):]
+            if retry:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.maxBackoff)
+            else:
+                backoff = self.backoff
+
+        # A finished build starts over next time, so rebuilding from the same progress file works
+        if not failed:
+            self.reset()
+        return failed
+
+    def reset(self):
+        """
+        Forget the progress made so far and delete the progress file.
+        """
+        self.done = set()
+        if self.progress and os.path.exists(self.progress):
+            os.remove(self.progress)
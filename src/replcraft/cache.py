@@ -0,0 +1,230 @@
+from collections import OrderedDict
+
+
+class Entry:
+    __slots__ = ('value', 'count')
+
+    def __init__(self, value):
+        self.value = value
+        self.count = 1
+
+
+#
+# Eviction policies
+# Each tracks keys only; the store holds the values.
+#
+
+class LRU:
+    """
+    Evicts the least recently used key.
+    """
+    def __init__(self):
+        self.order = OrderedDict()
+
+    def insert(self, key, entry):
+        self.order[key] = None
+
+    def touch(self, key, entry):
+        self.order.move_to_end(key)
+
+    def remove(self, key, entry):
+        del self.order[key]
+
+    def victims(self, keep):
+        key = next(iter(self.order))
+        return [] if key == keep else [key]
+
+
+class LFU:
+    """
+    Evicts the least frequently used key, the least recently used among ties.
+    """
+    def __init__(self):
+        self.buckets = {} # use count -> OrderedDict of keys
+        self.least = 0
+
+    def insert(self, key, entry):
+        self.buckets.setdefault(entry.count, OrderedDict())[key] = None
+        self.least = entry.count
+
+    def touch(self, key, entry):
+        bucket = self.buckets[entry.count - 1]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[entry.count - 1]
+            if self.least == entry.count - 1:
+                self.least = entry.count
+        self.buckets.setdefault(entry.count, OrderedDict())[key] = None
+
+    def remove(self, key, entry):
+        bucket = self.buckets[entry.count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[entry.count]
+            if self.least == entry.count and self.buckets:
+                self.least = min(self.buckets)
+
+    def victims(self, keep):
+        for count in [self.least] + sorted(self.buckets):
+            for key in self.buckets.get(count, ()):
+                if key != keep:
+                    return [key]
+        return []
+
+
+def blockRegion(key, size=16):
+    """
+    Region of a position key, or of the position at the end of a longer key.
+    Keys without a position, such as reads of the whole structure, share the region None.
+    """
+    x, y, z = key[-3:]
+    if x is None or y is None or z is None:
+        return None
+    return (x // size, y // size, z // size)
+
+
+class Region:
+    """
+    Evicts every key of the least recently used region at once,
+    so whole areas of a structure stay cached together.
+    """
+    def __init__(self, region=blockRegion):
+        self.region = region
+        self.regions = OrderedDict() # region -> set of keys
+
+    def insert(self, key, entry):
+        region = self.region(key)
+        self.regions.setdefault(region, set()).add(key)
+        self.regions.move_to_end(region)
+
+    def touch(self, key, entry):
+        self.regions.move_to_end(self.region(key))
+
+    def remove(self, key, entry):
+        region = self.region(key)
+        keys = self.regions[region]
+        keys.discard(key)
+        if not keys:
+            del self.regions[region]
+
+    def victims(self, keep):
+        return [key for key in next(iter(self.regions.values())) if key != keep]
+
+
+POLICIES = {'lru': LRU, 'lfu': LFU, 'region': Region}
+
+
+class BoundedStore:
+    """
+    Dict-like store holding at most `capacity` entries, evicting by `policy`
+    ('lru', 'lfu', 'region' or a policy instance). `onEvict(key, value)` is called
+    for every evicted entry. `capacity=None` keeps everything.
+    Not thread-safe: owners shared between threads hold their own lock around it.
+    """
+    def __init__(self, capacity=None, policy='lru', onEvict=None):
+        self.capacity = capacity
+        self.policy = POLICIES[policy]() if isinstance(policy, str) else policy
+        self.onEvict = onEvict
+        self.entries = {} # key -> Entry
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, key):
+        return self.entries[key].value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        entry = self.entries.pop(key)
+        self.policy.remove(key, entry)
+
+    def items(self):
+        return ((key, entry.value) for key, entry in self.entries.items())
+
+    def get(self, key, default=None):
+        """
+        Value for a key, counted as a use.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry.count += 1
+        self.policy.touch(key, entry)
+        return entry.value
+
+    def fetch(self, key, loader):
+        """
+        Value for a key, loaded with `loader()` and stored on a miss.
+        A loader returning None is not stored.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            return self.get(key)
+        self.misses += 1
+        value = loader()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        entry = self.entries.get(key)
+        if entry is not None:
+            # A rewrite counts as a use, so the newest writes are not the first evicted
+            entry.value = value
+            entry.count += 1
+            self.policy.touch(key, entry)
+            return
+        entry = self.entries[key] = Entry(value)
+        self.policy.insert(key, entry)
+        self._evict(key)
+
+    def pop(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        del self[key]
+        return entry.value
+
+    def clear(self):
+        for key in list(self.entries):
+            del self[key]
+
+    # Evict until within capacity, never evicting the key just added
+    def _evict(self, keep):
+        while self.capacity is not None and len(self.entries) > self.capacity:
+            victims = self.policy.victims(keep)
+            if not victims:
+                return
+            for key in victims:
+                value = self.pop(key)
+                self.evictions += 1
+                if self.onEvict:
+                    self.onEvict(key, value)
+
+    def stats(self):
+        """
+        Hit, miss and eviction counters.
+                Returns:
+                    dict
+        """
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,231 @@
+import itertools
+import threading
+import time
+
+from .cache import BoundedStore
+from .errors import CraftTimeout
+from .pending import Request
+
+# Actions whose replies depend on a position
+POSITIONAL = ('get_block', 'get_sign_text', 'get_inventory', 'get_power_level')
+
+
+def readKey(frame):
+    """
+    Key that identifies identical read requests.
+            Parameters:
+                frame (dict): Request
+            Returns:
+                tuple
+    """
+    return (frame['action'], frame.get('x'), frame.get('y'), frame.get('z'))
+
+
+class Flight:
+    __slots__ = ('callbacks', 'done', 'result', 'error', 'handle', 'stale')
+
+    def __init__(self):
+        self.stale = False # Invalidated while in flight, so its reply is not cached
+        self.handle = None
+        self.error = None
+        self.callbacks = []
+        self.done = threading.Event()
+        self.result = None
+
+
+class Coalescer:
+    """
+    Single-flight read coalescing with an optional per-action result cache.
+    Concurrent reads with the same key share one request and all get its reply;
+    successful replies are reused for `ttl[action]` seconds. A reply to a read sent before
+    an invalidation is handed to its callers but not cached, since it may predate the change.
+    At most `capacity` replies are cached, evicted by `policy`.
+    With `pending` (a `replcraft.pending.Pending`), every caller gets a handle of its own,
+    so callers time out and cancel independently of the flight they share.
+    """
+    def __init__(self, ttl=None, capacity=4096, policy='lru', pending=None):
+        self.ttl = dict(ttl or {}) # action -> seconds
+        self.flights = {} # key -> Flight
+        self.cache = BoundedStore(capacity, policy) # key -> (expiry, reply)
+        self.pending = pending
+        self._joins = itertools.count()
+        self._lock = threading.Lock()
+
+        self.requests = 0 # Reads asked for
+        self.sent = 0 # Reads that went to the server
+        self.coalesced = 0 # Reads that joined one in flight
+        self.cached = 0 # Reads answered from the cache
+
+    def stats(self):
+        """
+        Read counters, `saved` being the requests that were never sent.
+                Returns:
+                    dict
+        """
+        return {
+            'requests': self.requests,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'cached': self.cached,
+            'saved': self.coalesced + self.cached,
+            'cache': self.cache.stats()
+        }
+
+    # Cached reply or None, called with the lock held
+    def _cached(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self.cache.pop(key)
+            return None
+        return entry[1]
+
+    def _finish(self, key, flight, reply):
+        with self._lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            ttl = self.ttl.get(key[0])
+            if ttl and not flight.stale and reply and reply.get('ok', True) is not False:
+                self.cache[key] = (time.monotonic() + ttl, reply)
+        flight.result = reply
+        flight.done.set()
+        for callback in flight.callbacks:
+            callback(reply)
+
+    def request(self, key, start, callback, timeout=None):
+        """
+        Callback style read. `start(done)` is called to send the request when nothing
+        is in flight for `key`; every callback gets the reply passed to `done`.
+        If `start` raises, every callback gets an error reply and the error is raised here.
+                Parameters:
+                    key (tuple): Read key
+                    start (function): Sends the request, returns its handle
+                    callback (function): Called with the reply
+                    timeout (float): Seconds this caller waits, used when the coalescer has `pending`
+                Returns:
+                    Request, this caller's own handle with `pending`, otherwise the flight's
+        """
+        with self._lock:
+            self.requests += 1
+            reply = self._cached(key)
+            if reply is None:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Flight()
+                    self.sent += 1
+                else:
+                    self.coalesced += 1
+                handle = self._join(flight, callback, timeout)
+            else:
+                self.cached += 1
+
+        if reply is not None:
+            callback(reply)
+            return Request.completed(reply)
+        if leader:
+            try:
+                flight.handle = start(lambda msg: self._finish(key, flight, msg))
+            except Exception as error:
+                # Nothing was sent, so end the flight instead of leaving its callers waiting
+                flight.error = error
+                self._finish(key, flight, {'ok': False, 'error': str(error)})
+                raise
+        return handle or flight.handle
+
+    # Attach a caller to a flight, called with the lock held
+    def _join(self, flight, callback, timeout):
+        if self.pending is None:
+            flight.callbacks.append(callback)
+            return None
+        nonce = ('read', next(self._joins))
+
+        # Timeout and cancel replies name the request sent, not this caller's internal nonce
+        def deliver(reply):
+            if reply.get('nonce') == nonce:
+                reply = {key: value for key, value in reply.items() if key != 'nonce'}
+                if flight.handle is not None:
+                    reply['nonce'] = flight.handle.nonce
+            callback(reply)
+
+        handle = self.pending.add(nonce, deliver, timeout)
+        flight.callbacks.append(lambda reply: self.pending.resolve(nonce, reply))
+        return handle
+
+    def call(self, key, fetch, timeout=None):
+        """
+        Blocking read. The first caller runs `fetch()`, concurrent callers wait for its reply
+        or get the error it raised.
+                Parameters:
+                    key (tuple): Read key
+                    fetch (function): Sends the request and returns the reply
+                    timeout (float): Longest a caller joining a read in flight waits, in seconds
+                Returns:
+                    dict
+                Raises:
+                    CraftTimeout: a joining caller's timeout passed first
+        """
+        with self._lock:
+            self.requests += 1
+            reply = self._cached(key)
+            if reply is not None:
+                self.cached += 1
+                return reply
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.sent += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise CraftTimeout('no reply to %s read in time' % key[0])
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        reply = None
+        try:
+            reply = fetch()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            self._finish(key, flight, reply)
+        return reply
+
+    def invalidate(self, x, y, z):
+        """
+        Drop cached replies for a position, and keep replies to reads of it in flight out of the cache.
+        """
+        if x is None:
+            return
+        with self._lock:
+            for action in POSITIONAL:
+                self.cache.pop((action, x, y, z), None)
+                flight = self.flights.get((action, x, y, z))
+                if flight:
+                    flight.stale = True
+
+    def invalidateAction(self, action):
+        """
+        Drop cached replies for an action, and keep replies to reads of it in flight out of the cache.
+        """
+        with self._lock:
+            for key in [key for key in self.cache if key[0] == action]:
+                self.cache.pop(key)
+            for key, flight in self.flights.items():
+                if key[0] == action:
+                    flight.stale = True
+
+    def clear(self):
+        """
+        Drop every cached reply.
+        """
+        with self._lock:
+            self.cache.clear()
+            for flight in self.flights.values():
+                flight.stale = True
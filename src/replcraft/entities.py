@@ -0,0 +1,196 @@
+import math
+import time
+
+
+class SpatialGrid:
+    """
+    Uniform grid over (x, y, z) points; each cell holds the ids of the points inside it.
+    """
+    def __init__(self, cell=8):
+        self.cell = cell
+        self.cells = {} # (cx, cy, cz) -> set of ids
+        self.points = {} # id -> (x, y, z)
+
+    def _key(self, x, y, z):
+        c = self.cell
+        return (math.floor(x / c), math.floor(y / c), math.floor(z / c))
+
+    def insert(self, id, x, y, z):
+        """
+        Add or move a point.
+        """
+        self.remove(id)
+        self.points[id] = (x, y, z)
+        self.cells.setdefault(self._key(x, y, z), set()).add(id)
+
+    def remove(self, id):
+        """
+        Drop a point, if present.
+        """
+        pos = self.points.pop(id, None)
+        if pos is None:
+            return
+        key = self._key(*pos)
+        cell = self.cells[key]
+        cell.discard(id)
+        if not cell:
+            del self.cells[key]
+
+    def within(self, x1, y1, z1, x2, y2, z2):
+        """
+        Ids of the points inside an axis-aligned box, bounds included.
+                Returns:
+                    list
+        """
+        lo = self._key(min(x1, x2), min(y1, y2), min(z1, z2))
+        hi = self._key(max(x1, x2), max(y1, y2), max(z1, z2))
+        found = []
+        for cx in range(lo[0], hi[0] + 1):
+            for cy in range(lo[1], hi[1] + 1):
+                for cz in range(lo[2], hi[2] + 1):
+                    for id in self.cells.get((cx, cy, cz), ()):
+                        px, py, pz = self.points[id]
+                        if (min(x1, x2) <= px <= max(x1, x2) and min(y1, y2) <= py <= max(y1, y2)
+                                and min(z1, z2) <= pz <= max(z1, z2)):
+                            found.append(id)
+        return found
+
+    def near(self, x, y, z, radius):
+        """
+        Ids of the points within `radius` blocks of a position.
+                Returns:
+                    list
+        """
+        r2 = radius * radius
+        return [
+            id for id in self.within(x - radius, y - radius, z - radius, x + radius, y + radius, z + radius)
+            if sum((a - b) ** 2 for a, b in zip(self.points[id], (x, y, z))) <= r2
+        ]
+
+
+def entityIds(entities):
+    """
+    Stable ids for an entity list: the player UUID for players,
+    otherwise type and name numbered by order of appearance.
+            Parameters:
+                entities (list): Entities from get_entities
+            Returns:
+                dict of id -> entity
+    """
+    ids = {}
+    seen = {}
+    for entity in entities:
+        if entity.get('player_uuid'):
+            ids[entity['player_uuid']] = entity
+            continue
+        key = (entity.get('type'), entity.get('name'))
+        seen[key] = seen.get(key, 0) + 1
+        ids[key + (seen[key],)] = entity
+    return ids
+
+
+class EntityTracker:
+    """
+    Polls a `jarci2.Client` for entities, diffs snapshots and keeps them in a `SpatialGrid`.
+    The poll interval halves while entities are changing and doubles while idle,
+    between `fastest` and `slowest` seconds.
+    Events: 'enter' and 'leave' (tracker, id, entity), 'move' (tracker, id, entity, previous).
+    """
+    def __init__(self, client, cell=8, fastest=0.25, slowest=4, threshold=0.1):
+        self.client = client
+        self.grid = SpatialGrid(cell)
+        self.entities = {} # id -> latest entity
+
+        self.fastest = fastest
+        self.slowest = slowest
+        self.interval = fastest
+        self.threshold = threshold # Distance an entity must move to count as moved
+
+        self.events = {}
+        self.running = False
+
+    # Events
+    def on(self, event: str):
+        def decorator(func):
+            self.events[event] = func
+            return func
+        return decorator
+
+    def _emit(self, event, *args):
+        if event in self.events:
+            self.events[event](self, *args)
+
+    def update(self, entities):
+        """
+        Apply a snapshot, emitting events for what changed.
+                Parameters:
+                    entities (list): Entities from get_entities
+                Returns:
+                    int, number of changes
+        """
+        current = entityIds(entities)
+        changes = 0
+
+        for id in [id for id in self.entities if id not in current]:
+            entity = self.entities.pop(id)
+            self.grid.remove(id)
+            self._emit('leave', id, entity)
+            changes += 1
+
+        t2 = self.threshold * self.threshold
+        for id, entity in current.items():
+            previous = self.entities.get(id)
+            self.entities[id] = entity
+            pos = (entity['x'], entity['y'], entity['z'])
+            if previous is None:
+                self.grid.insert(id, *pos)
+                self._emit('enter', id, entity)
+                changes += 1
+            elif sum((a - b) ** 2 for a, b in zip(pos, self.grid.points[id])) > t2:
+                self.grid.insert(id, *pos)
+                self._emit('move', id, entity, previous)
+                changes += 1
+
+        return changes
+
+    def poll(self):
+        """
+        Take one snapshot and adapt the poll interval.
+                Returns:
+                    int, number of changes
+        """
+        reply = self.client.getEntities()
+        changes = self.update((reply or {}).get('entities', []))
+        if changes:
+            self.interval = max(self.fastest, self.interval / 2)
+        else:
+            self.interval = min(self.slowest, self.interval * 2)
+        return changes
+
+    def run(self):
+        """
+        Poll until `stop` is called.
+        """
+        self.running = True
+        while self.running:
+            self.poll()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+    def near(self, x, y, z, radius):
+        """
+        Entities within `radius` blocks of a position.
+                Returns:
+                    list
+        """
+        return [self.entities[id] for id in self.grid.near(x, y, z, radius)]
+
+    def within(self, x1, y1, z1, x2, y2, z2):
+        """
+        Entities inside an axis-aligned box.
+                Returns:
+                    list
+        """
+        return [self.entities[id] for id in self.grid.within(x1, y1, z1, x2, y2, z2)]
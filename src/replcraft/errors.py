@@ -0,0 +1,11 @@
+# Error Classes
+class CraftError(Exception):
+    pass
+
+# A request got no reply before its deadline
+class CraftTimeout(CraftError):
+    pass
+
+# A request was cancelled before its reply arrived
+class CraftCancelled(CraftError):
+    pass
@@ -0,0 +1,230 @@
+import time
+from collections import Counter, deque
+
+from .parse import spareFuel
+
+
+def actionCounts(actions):
+    """
+    Count actions from request frames, action names or an existing count.
+            Returns:
+                Counter
+    """
+    if isinstance(actions, Counter):
+        return actions
+    return Counter(
+        action['action'] if isinstance(action, dict) else action
+        for action in actions
+    )
+
+
+class FuelModel:
+    """
+    Per-action fuel costs and the regeneration rate, learned from fuelinfo deltas.
+    Costs start from the reply's `apis` figures when it has them, otherwise from `default`.
+    """
+    def __init__(self, default=1, smoothing=0.3, spare=spareFuel):
+        self.default = default
+        self.smoothing = smoothing # Weight of each new observation
+        self.spare = spare # Reads the spare fuel from a fuelinfo reply
+
+        self.costs = {} # action -> estimated fuel per call
+        self.rate = 0 # Fuel regenerated per second
+
+    def seed(self, info):
+        """
+        Take starting costs from a fuelinfo reply's `apis` section, where present.
+        """
+        for action, api in ((info or {}).get('apis') or {}).items():
+            cost = api.get('fuelCost', api.get('baseFuelCost'))
+            if cost is not None and action not in self.costs:
+                self.costs[action] = cost
+
+    def cost(self, action):
+        return self.costs.get(action, self.default)
+
+    def estimate(self, actions):
+        """
+        Fuel a set of actions is expected to use.
+                Parameters:
+                    actions (iterable): Request frames, action names or a Counter
+                Returns:
+                    float
+        """
+        return sum(self.cost(action) * count for action, count in actionCounts(actions).items())
+
+    def _blend(self, old, new):
+        return old + self.smoothing * (new - old)
+
+    def observe(self, before, after, actions, seconds=0):
+        """
+        Learn from the fuel used by a set of actions.
+        With one kind of action its cost is updated directly; with several,
+        every estimate is scaled by how far off the combined estimate was.
+        With no actions the change is taken as regeneration.
+                Parameters:
+                    before (dict): fuelinfo reply from before the actions
+                    after (dict): fuelinfo reply from after the actions
+                    actions (iterable): Request frames, action names or a Counter
+                    seconds (float): Time between the two replies
+        """
+        start, end = self.spare(before), self.spare(after)
+        if start is None or end is None:
+            return
+        counts = actionCounts(actions)
+
+        if not counts:
+            if seconds > 0 and end > start:
+                self.rate = self._blend(self.rate, (end - start) / seconds)
+            return
+
+        used = start - end + self.rate * seconds
+        if used <= 0:
+            return
+        if len(counts) == 1:
+            action, count = next(iter(counts.items()))
+            self.costs[action] = self._blend(self.cost(action), used / count)
+            return
+
+        predicted = self.estimate(counts)
+        if predicted > 0:
+            for action in counts:
+                self.costs[action] = self._blend(self.cost(action), self.cost(action) * used / predicted)
+
+
+    def underestimated(self, action):
+        """
+        An action ran out of fuel while its estimate said it would fit: double the estimate.
+        """
+        self.costs[action] = self.cost(action) * 2
+
+
+class FuelPlanner:
+    """
+    Splits a job into chunks that fit the fuel at hand and runs them through a `jarci2.Client`,
+    waiting for fuel to regenerate between chunks instead of running out.
+    """
+    def __init__(self, client, model=None, window=32, reserve=0, probe=1, interval=5):
+        self.client = client
+        self.model = model or FuelModel()
+        self.window = window
+        self.reserve = reserve # Fuel to always leave unspent
+        self.probe = probe # Seconds between fuel checks while the regeneration rate is unknown
+        self.interval = interval # Longest a fuel reading is trusted, in seconds
+
+        self.info = None # Last fuelinfo reply
+        self.checked = 0 # When it was read
+        self.spent = Counter() # Actions run since
+
+    def chunks(self, frames, budget):
+        """
+        Split frames into consecutive chunks whose estimated cost fits the budget.
+        A frame that costs more than the whole budget gets a chunk of its own.
+                Parameters:
+                    frames (list): Request frames
+                    budget (float): Fuel per chunk
+                Returns:
+                    list of lists
+        """
+        chunks = []
+        chunk = []
+        spent = 0
+        for frame in frames:
+            cost = self.model.cost(frame['action'])
+            if chunk and spent + cost > budget:
+                chunks.append(chunk)
+                chunk, spent = [], 0
+            chunk.append(frame)
+            spent += cost
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def run(self, frames, budget=None, maxWait=60, retries=3):
+        """
+        Run frames chunk by chunk, sizing each chunk from the fuel at hand and the costs learned so far.
+        Frames that still run out of fuel are retried up to `retries` times.
+        The fuel at hand is estimated from the last fuelinfo reading and the fuel spent since, so
+        repeated small runs do not each pay for fuel checks; fuel is read again when the estimate
+        falls short, a frame runs out of fuel or the reading is older than `interval` seconds.
+                Parameters:
+                    frames (list): Request frames
+                    budget (float): Most fuel to spend per chunk, defaults to no limit beyond the spare fuel
+                    maxWait (float): Longest wait for fuel before a chunk, in seconds
+                    retries (int): Attempts per frame after the first
+                Returns:
+                    list of replies, in frame order
+        """
+        if self.info is None or time.monotonic() - self.checked > self.interval:
+            self.refresh()
+
+        replies = [None] * len(frames)
+        attempts = [0] * len(frames)
+        queue = deque(range(len(frames)))
+        while queue:
+            spare = self.spare()
+            needed = self.model.cost(frames[queue[0]]['action']) + self.reserve
+            if spare is not None and spare < needed:
+                # The estimate may be behind; check the real figure before waiting
+                self.refresh()
+                spare = self.spare()
+            waited = 0
+            while spare is not None and spare < needed and waited < maxWait:
+                # Until the regeneration rate is known, check back every `probe` seconds
+                pause = (needed - spare) / self.model.rate if self.model.rate > 0 else self.probe
+                pause = min(pause, maxWait - waited)
+                time.sleep(pause)
+                waited += pause
+                self.refresh()
+                spare = self.spare()
+
+            allowance = budget
+            if spare is not None:
+                allowance = spare - self.reserve if budget is None else min(budget, spare - self.reserve)
+            chunk = [queue.popleft()]
+            spent = self.model.cost(frames[chunk[0]]['action'])
+            while queue and (allowance is None or spent + self.model.cost(frames[queue[0]]['action']) <= allowance):
+                spent += self.model.cost(frames[queue[0]]['action'])
+                chunk.append(queue.popleft())
+
+            retry = []
+            for index, reply in zip(chunk, self.client.batch([frames[i] for i in chunk], self.window)):
+                replies[index] = reply
+                attempts[index] += 1
+                if reply and reply.get('error') == 'out of fuel':
+                    if attempts[index] <= retries:
+                        retry.append(index)
+                else:
+                    self.spent[frames[index]['action']] += 1
+            queue.extendleft(reversed(retry))
+            for action in {frames[index]['action'] for index in retry}:
+                self.model.underestimated(action)
+
+            if retry or time.monotonic() - self.checked > self.interval:
+                self.refresh()
+        return replies
+
+    def refresh(self):
+        """
+        Read the fuel, learning costs and the regeneration rate from the change since the last reading.
+                Returns:
+                    dict, the fuelinfo reply
+        """
+        info = self.client.fuelInfo()
+        now = time.monotonic()
+        self.model.seed(info)
+        if self.info is not None:
+            self.model.observe(self.info, info, self.spent, now - self.checked)
+        self.info, self.checked, self.spent = info, now, Counter()
+        return info
+
+    def spare(self):
+        """
+        Estimated fuel at hand: the last reading, less what was spent since, plus what regenerated.
+                Returns:
+                    float, or None if fuel is unknown
+        """
+        spare = self.model.spare(self.info)
+        if spare is None:
+            return None
+        return spare - self.model.estimate(self.spent) + self.model.rate * (time.monotonic() - self.checked)
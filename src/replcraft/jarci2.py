@@ -1,546 +1,249 @@
 import websocket
-import json
-from base64 import b64decode
+import threading
+import time
+from collections import deque
 
-class Client:
+from .base import BaseClient
+from .coalesce import readKey
+from .errors import CraftError, CraftTimeout, CraftCancelled
+from .writer import Writer
+
+class Client(BaseClient):
     """
-    Replcraft Instance    
+    Replcraft Instance
     """
-    def __init__(self, token):
-        # Extract token
-        self.token = token.replace('http://', '')
-        self.config = json.loads(b64decode(token.split('.')[1] + '===='))
+    def __init__(self, token, ledger=None):
+        super().__init__(token, ledger)
 
-        # Nonce
-        self.nonce = "0"
+        # Longest a blocked read goes without checking for cancellation, in seconds
+        self.wakeup = 0.25
 
-        # Event manager
-        self.events = {}
+        # Messages read while waiting for replies, replayed by the event loop,
+        # as (time received, message)
+        self.backlog = deque()
+        # Most messages kept in the backlog; older ones are handed to the event handlers
+        # right away, since nothing may be running the event loop
+        self.backlogLimit = 4096
 
-        # Out of Fuel Queue (unimplemented)
-        self.queue = {}
+        # Held by whoever reads the socket: the event loop for as long as it runs,
+        # or a call waiting on its reply for one read at a time
+        self._reader = threading.RLock()
 
     def login(self):
         """
         Create and start the websocket connection
         """
-        self.ws = websocket.create_connection('ws://' + self.config['host'] + '/gateway')
-
-        self._open()
-        self._recv()
-        
-        # Run open event
-        self._event('open')(self)  
-        
-        while True:
-            msg = self._recv()
-            
-            # Check if error occured
-            if msg.get('ok', False) and msg['ok'] == False:
-                if msg.get('error', False):
-                    if msg['error'] == 'out of fuel' and 'out of fuel' in self.events:
-                        self._event('out of fuel')(self, msg)
-                    elif 'error' in self.events: 
-                        self._event('error')(self, msg['error'], msg)
-            
-            # Transaction Handling
-            if 'transact' in self.events and msg.get('type', False) == 'transact': 
-    
-                # Accept and Deny functions
-                def accept():
-                    self._send({
-                        'action': 'respond',
-                        'nonce': self.nonce,
-                        'queryNonce': msg['queryNonce'],
-                        'accept': True
-                    })
-                def deny():
-                    self._send({
-                        'action': 'respond',
-                        'nonce': self.nonce,
-                        'queryNonce': msg['queryNonce'],
-                        'accept': False
-                    })
-    
-                msg['accept'] = accept
-                msg['deny'] = deny
-                # Split up message into arguments
-                msg['query'] = msg['query'].split(' ')
-                    
-                # Run event listener
-                self._event('transact')(self, msg)
-    
-            # Block Update Handling
-            elif 'block update' in self.events and msg.get('type', False) == 'block update':
-                self._event('block update')(self, msg['cause'], msg['block'], msg['x'], msg['y'], msg['z'])
-    
-            # Events
-            if msg.get('event', False) and 'event' in self.events['event']:
-                self._event('event')(self, msg['event'], msg['cause'], msg['block'], msg['x'], msg['y'], msg['z'])
-
-    # Events
-    def on(self, event: str):
+        self.connect()
+        self.listen()
+
+    def connect(self):
         """
-        Add function to event 
-                Parameters:
-                    event (str): Event manager
-                Returns:
-                    decorator
+        Open the websocket connection and authenticate, without starting the event loop.
+        Requests can be made right away; replies are read by the calls that wait on them.
         """
-        def decorator(func):
-            self.events[event] = func
-            def wrapper(*args, **kwargs):
-                result = func(*args, **kwargs)
-                return result
-            return wrapper
-        return decorator
-    
-    def _event(self, event: str):
-        return self.events.get(event, False)
-
-    def _open(self):
-        self._send(
-            {
-                "action": "authenticate",
-                "token": self.token,
-                "nonce": self.nonce
-            }
-        )    
-
-    # Private Send Function
-    def _send(self, data):
-        self.ws.send(json.dumps(data))
-        self.nonce = str(int(self.nonce) + 1)
-
-        self.queue = data
-        
-    # Private Recieve Function
-    def _recv(self):
-        msg = self.ws.recv()
+        self.ws = websocket.create_connection(self.protocol.url)
+        self.writer = Writer(self.ws)
 
-        if msg: # Check if message is an empty string, JSON cannot handle empty strings
-            msg = json.loads(msg)
-        else:
-            return
+        self._send(self.protocol.authenticate())
 
-        if msg.get('error') == 'out of fuel':
-            self._send(self.queue)
+    def listen(self):
+        """
+        Run the event loop on an open connection, handing messages to the event handlers.
+        While it runs, calls on other threads wait for the event loop to read their replies.
+        """
+        with self._reader:
+            while True:
+                if self.backlog:
+                    received, msg = self.backlog.popleft()
+                else:
+                    try:
+                        msg = self._recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    received = time.monotonic()
+                if msg is None:
+                    continue
 
-        return msg
+                kinds = self.protocol.receive(msg)
+                self._dispatch(msg, kinds, received)
 
-    #
-    # Tell & Pay Functions
-    #
+    # Disconnect Function
+    def disconnect(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        self.ws.close()
 
-    def tell(self, target: str, message: str) -> dict:
-        """
-        Send a message to a player inside a structure
-                Parameters:
-                    target (str): Player Name or UUID
-                    message (str): Message to send to player
-                Returns:
-                    dict
-        """
-        return self._send(
-            {
-                "action": "tell",
-                "target": target,
-                "message": message,
-                "nonce": self.nonce
-            }
-        )
-    
-    def pay(self, target: str, amount: str) -> dict:
-        """
-        Send money to a player.
+        # No replies will come, so nothing waits on them until its deadline
+        self.pending.cancelAll()
+
+    # Private Recieve Function
+    def _recv(self):
+        return self.protocol.decode(self.ws.recv())
+
+    # Send a read request and wait for its reply, sharing it with identical reads already in flight
+    def _read(self, frame, timeout=None):
+        def fetch():
+            request = self._request(frame, timeout=timeout)
+            self._pump(request)
+            return request.result()
+
+        return self.reads.call(readKey(frame), fetch, self.timeout if timeout is None else timeout)
+
+    # Read until a request finishes, keeping other messages for the event loop.
+    # If the event loop runs on another thread it reads the reply, and this only waits for it.
+    def _pump(self, request):
+        while not request.done():
+            wait = self.wakeup
+            if request.deadline is not None:
+                wait = min(wait, max(request.deadline - time.monotonic(), 0.001))
+
+            if self._reader.acquire(blocking=False):
+                try:
+                    msg = self._recvFor(wait)
+                finally:
+                    self._reader.release()
+
+                if msg is not None and self.protocol.receive(msg):
+                    self.backlog.append((time.monotonic(), msg))
+                    while len(self.backlog) > self.backlogLimit:
+                        received, msg = self.backlog.popleft()
+                        self._dispatch(msg, self.protocol.receive(msg), received)
+            else:
+                request.wait(wait)
+
+            # Checked on every message too, so a busy connection cannot hold off a deadline
+            self.pending.expire()
+
+    # Receive one message, None if nothing arrives within `wait` seconds
+    def _recvFor(self, wait):
+        self.ws.settimeout(wait)
+        try:
+            return self._recv()
+        except websocket.WebSocketTimeoutException:
+            return None
+        finally:
+            self.ws.settimeout(None)
+
+    def batch(self, frames, window=32):
+        """
+        Send requests back-to-back, keeping up to `window` of them in flight, and collect their replies.
+        Replies are matched by nonce; anything else read meanwhile is kept for the event loop.
+        Error replies, including out of fuel, are returned as-is instead of being resent.
                 Parameters:
-                    target (str): Player Name or UUID
-                    amount (str): Amount of money to send to player
+                    frames (iterable): Request dicts
+                    window (int): Maximum number of unanswered requests
                 Returns:
-                    None
+                    list
         """
-        self._send(
-            {
-                "action": "tell",
-                "target": target,
-                "amount": amount,
-                "nonce": self.nonce
-            }
-        )
+        requests = []
+        for frame in frames:
+            if len(requests) >= window:
+                self._pump(requests[len(requests) - window])
+            requests.append(self._request(frame))
+
+        for request in requests:
+            self._pump(request)
+        return [request.reply for request in requests]
 
     #
     # Block Functions
     # From bobbypin's ReplCraftPy library
     #
 
-    def getBlock(self, x, y, z):
-        """
-        Retrieves a block at the given structure-local coordinates.
-                Parameters:
-                    x (int): X coordinate
-                    y (int): Y coordinate
-                    z (int): Z coordinate
-                Returns:
-                    dict
-        """
-        self._send(
-            {
-                "action":"get_block",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
-
-        return self._recv()
-
-    def location(self, x, y, z):
+    def getBlock(self, x, y, z, timeout=None):
         """
         Retrieves a block at the given structure-local coordinates.
                 Parameters:
                     x (int): X coordinate
                     y (int): Y coordinate
                     z (int): Z coordinate
+                    timeout (float): Seconds to wait for the reply, defaults to client.timeout
                 Returns:
-                    dict
-        """
-        self._send(
-            {
-                "action":"get_location",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
-
-        return self._recv()
-        
-    def getSize(self):
-        """
-        Retrieves the inner size of the structure.
-                Returns:
-                    dict
-        """
-        self._send(
-            {
-                "action":"get_size",
-                "nonce": self.nonce
-            }
-        )
-
-        return self._recv()
-
-    def setBlock(self, x, y, z, blockdata, 
-                 source_x=None, source_y=None, source_z=None, 
-                 target_x=None, target_y=None, target_z=None
-            ):
-        """
-        Sets a block at the given structure-local coordinates. 
-        The block must be available in the specified source chest or the structure inventory. 
-        Any block replaced by this call is stored in the specified target chest or the structure inventory, or dropped in the world if there's no space.
-                Parameters:
-                    x (int): X coordinate
-                    y (int): Y coordinate
-                    z (int): Z coordinate
-                    x (str): Blockdata       
-                    **source_x (int): The X coordinate of the container the block to set is in.
-                    **source_y (int): The Y coordinate of the container the block to set is in.
-                    **source_z (int): The Z coordinate of the container the block to set is in.
-                    **target_x (int): The X coordinate of the container the block replaced should go to.
-                    **target_y (int): The Y coordinate of the container the block replaced should go to.
-                    **target_z (int): The Z coordinate of the container the block replaced should go to.
-                Returns:
-                    None
-        """
-        return self._send({
-                "action":"set_block",
-                "x": x,
-                "y": y,
-                "z": z,
-                "blockData": blockdata,
-                "source_x": source_x,
-                "source_y": source_y,
-                "source_z": source_z,
-                "target_x": target_x,
-                "target_y": target_y,
-                "target_z": target_z,
-                "nonce": self.nonce
-            })
-
-    def getSignText(self, x, y, z):      
+                    BlockResponse, which also reads like the reply dict
+                Raises:
+                    CraftTimeout: no reply arrived in time
+                    CraftCancelled: the request was cancelled
+        """
+        msg = self._read(self.protocol.getBlock(x, y, z), timeout)
+        if msg and 'block' in msg:
+            self.blocks.update(x, y, z, msg['block'])
+        return msg
+
+    def block(self, x, y, z, timeout=None):
         """
-        Retrieves the text of a sign at the given coordinates.
+        Block data at the given structure-local coordinates, from client.blocks when known,
+        otherwise read from the structure.
                 Parameters:
                     x (int): X coordinate
                     y (int): Y coordinate
                     z (int): Z coordinate
+                    timeout (float): Seconds to wait for a read, defaults to client.timeout
                 Returns:
-                    dict
+                    str, or None if the read failed
         """
-        self._send(
-            {
-                "action":"get_sign_text",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
-        
-        return self._recv()
-
-    def setSignText(self, x, y, z, lines):
+        known = self.blocks.get(x, y, z)
+        if known is not None:
+            return known
+        return (self.getBlock(x, y, z, timeout) or {}).get('block')
+
+    def location(self, x, y, z, timeout=None):
         """
-        Sets the text of a sign at the given coordinates.
+        Retrieves a block at the given structure-local coordinates.
                 Parameters:
                     x (int): X coordinate
                     y (int): Y coordinate
                     z (int): Z coordinate
-                    lines (list): Lines to set
+                    timeout (float): Seconds to wait for the reply, defaults to client.timeout
                 Returns:
                     dict
+                Raises:
+                    CraftTimeout: no reply arrived in time
+                    CraftCancelled: the request was cancelled
         """
-        return self._send(
-            {
-                "action":"set_sign_text",
-                "x": x,
-                "y": y,
-                "z": z,
-                "lines": lines,
-                "nonce": self.nonce
-            }
-        )
-
-    def watch(self, x, y, z):
+        return self._read(self.protocol.location(x, y, z), timeout)
+
+    def getSize(self, timeout=None):
         """
-        Begins watching a block for updates.
+        Retrieves the inner size of the structure.
                 Parameters:
-                    x (int): X coordinate
-                    y (int): Y coordinate
-                    z (int): Z coordinate
+                    timeout (float): Seconds to wait for the reply, defaults to client.timeout
                 Returns:
                     dict
+                Raises:
+                    CraftTimeout: no reply arrived in time
+                    CraftCancelled: the request was cancelled
         """
-        return self._send(
-            {
-                "action":"watch",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
-
-    def unwatch(self, x, y, z):
+        return self._read(self.protocol.getSize(), timeout)
+
+    def getSignText(self, x, y, z, timeout=None):
         """
-        Stops watching a block for updates.
+        Retrieves the text of a sign at the given coordinates.
                 Parameters:
                     x (int): X coordinate
                     y (int): Y coordinate
                     z (int): Z coordinate
+                    timeout (float): Seconds to wait for the reply, defaults to client.timeout
                 Returns:
                     dict
+                Raises:
+                    CraftTimeout: no reply arrived in time
+                    CraftCancelled: the request was cancelled
         """
-
-        return self._send(
-            {
-                "action":"unwatch",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
-
-    # Begins watching all blocks in the structure for updates.
-    def watchAll(self):
-        return self._send(
-            {
-                "action":"watch_all",
-                "nonce": self.nonce
-            }
-        )
-
-    # Stops watching all blocks for updates.
-    def unwatchAll(self):
-        return self._send(
-            {
-                "action":"unwatch_all",
-                "nonce": self.nonce
-            }
-        )
-
-    # Begins polling all blocks in the structure for updates.
-    # Updates will be very slow!
-    def pollAll(self):
-        return self._send(
-            {
-                "action":"poll_all",
-                "nonce": self.nonce
-            }
-        )
-
-    # Stops polling all blocks in the structure.
-    def unpollAll(self):
-        return self._send(
-            {
-                "action":"unpoll_all",
-                "nonce": self.nonce
-            }
-        )
-
-    # Begins polling a block for updates.
-    # Note that this catches all possible block updates, but only one block is polled per tick.
-    # The more blocks you poll, the slower each individual block will be checked.
-    # Additionally, if a block changes multiple times between polls, only the latest change
-    # will be reported.
-    def poll(self, x, y, z):
-        return self._send(
-            {
-                "action":"poll",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
-
-    # Stops watching a block for updates.
-    def unpoll(self, x, y, z):
-        return self._send(
-            {
-                "action":"unpoll",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-            }
-        )
+        return self._read(self.protocol.getSignText(x, y, z), timeout)
 
     # Gets all entities inside the region.
-    def getEntities(self):
-        self._send({
-                "action":"get_entities",
-                "nonce": self.nonce
-        })
-        
-        return self._recv()
+    def getEntities(self, timeout=None):
+        return self._read(self.protocol.getEntities(), timeout)
 
     # Gets all items from a container such as a chest or hopper.
-    def getInventory(self, x, y, z):
-        self._send({
-                "action":"get_inventory",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-        })
-
-        return self._recv()
-
-    # Moves an item between containers.
-    def moveItem(self, index,
-            source_x, source_y, source_z, 
-            target_x, target_y, target_z,
-            amount=None, target_index=None
-        ):
-        return self._send({
-                "action":"move_item",
-                "amount": amount,
-                "index": index,
-                "source_x": source_x,
-                "source_y": source_y,
-                "source_z": source_z,
-                "target_index": target_index,
-                "target_x": target_x,
-                "target_y": target_y,
-                "target_z": target_z,
-                "nonce": self.nonce
-            })
+    def getInventory(self, x, y, z, timeout=None):
+        return self._read(self.protocol.getInventory(x, y, z), timeout)
 
     # Gets a block's redstone power level.
-    def getPowerLevel(self, x, y, z):
-        self._send({
-                "action":"get_power_level",
-                "x": x,
-                "y": y,
-                "z": z,
-                "nonce": self.nonce
-        })
-
-        return self._recv()
-
-    # Crafts an item, which is then stored into the given container.
-    def craft(self, x, y, z, recipe):
-        return self._send({
-                "action":"craft",
-                "x": x,
-                "y": y,
-                "z": z,
-                "ingredients": recipe,
-                "nonce": self.nonce
-            })
+    def getPowerLevel(self, x, y, z, timeout=None):
+        return self._read(self.protocol.getPowerLevel(x, y, z), timeout)
 
     # Fuel Info API
-    def fuelInfo(self):
-        self._send(
-            {
-                "action": "fuelinfo",
-                "nonce": self.nonce
-            }
-        )
-
-        return self._recv()
-        
-    # Index of an item withing a container.
-    #
-    # :index: index of the slot the time is in within the container.
-    # :x, y, z: the coordinates of the container.
-    class ItemIndex:
-        def __init__(self, index, x, y, z):
-            self.index = index # The index of the chest slot the item is in.
-            self.x = x
-            self.y = y
-            self.z = z
-    
-        def item(self):            
-            return {
-                    "index": self.index,
-                    "x": self.x,
-                    "y": self.y,
-                    "z": self.z
-                }
-    
-    # Recipe, matching it's vanilla definition
-    #
-    # :s1-s9: crafting table slots
-    class Recipe:
-        def __init__(self, 
-            s1=None, 
-            s2=None, 
-            s3=None, 
-            s4=None, 
-            s5=None, 
-            s6=None, 
-            s7=None, 
-            s8=None, 
-            s9=None
-        ):
-            self.s1 = s1
-            self.s2 = s2
-            self.s3 = s3
-            self.s4 = s4
-            self.s5 = s5
-            self.s6 = s6
-            self.s7 = s7
-            self.s8 = s8
-            self.s9 = s9
-    
-        def table(self):
-            return [
-                    self.s1, self.s2, self.s3,
-                    self.s4, self.s5, self.s6,
-                    self.s7, self.s8, self.s9
-                ]
+    def fuelInfo(self, timeout=None):
+        return self._read(self.protocol.fuelInfo(), timeout)
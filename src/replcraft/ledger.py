@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+
+RECEIVED = 'received'
+ACCEPTED = 'accepted'
+DENIED = 'denied'
+
+
+class Ledger:
+    """
+    Append-only transaction log, keyed by queryNonce.
+    Records are written as JSON lines and fsynced in groups: every writer waiting on the same
+    commit shares one fsync. The whole log is indexed in memory on load, so duplicate checks
+    and per-player totals never touch the file.
+    """
+    def __init__(self, path, interval=0.01, batch=256):
+        self.path = path
+        self.interval = interval # Longest a record waits for its commit, in seconds
+        self.batch = batch # Commit early once this many records are buffered
+
+        self.index = {} # queryNonce -> latest record
+        self.players = {} # player -> aggregate totals
+
+        self._buffer = []
+        self._written = 0 # Records handed to commit
+        self._committed = 0 # Records known to be on disk
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._closed = False
+
+        self._load()
+        self.file = open(path, 'a')
+
+        self._thread = threading.Thread(target=self._flusher, daemon=True)
+        self._thread.start()
+
+    # Replay the log, dropping a torn last line left by a crash
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        line = b''
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    break
+                except (KeyError, TypeError):
+                    pass # A malformed record is skipped
+                good += len(line)
+        if good != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good)
+        elif good and not line.endswith(b'\n'):
+            # The last record made it to disk without its newline; end it so the next one starts a line
+            with open(self.path, 'ab') as f:
+                f.write(b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _apply(self, record):
+        # Read every field first, so a malformed record changes nothing
+        queryNonce, state, player = record['queryNonce'], record['state'], record['player']
+        previous = self.index.get(queryNonce)
+        self.index[queryNonce] = record
+
+        stats = self.players.setdefault(player, {
+            'transactions': 0, ACCEPTED: 0, DENIED: 0, 'amount': 0
+        })
+        if state == RECEIVED:
+            if previous is None:
+                stats['transactions'] += 1
+        elif previous is None or previous['state'] == RECEIVED:
+            stats[state] += 1
+            if state == ACCEPTED:
+                stats['amount'] += record.get('amount') or 0
+
+    def _append(self, record, wait):
+        with self._lock:
+            self._apply(record)
+            self._buffer.append(json.dumps(record, separators=(',', ':')))
+            ticket = self._written + len(self._buffer)
+            if len(self._buffer) >= self.batch:
+                self._commit()
+            while wait and self._committed < ticket and not self._closed:
+                self._done.wait()
+
+    # Write and fsync everything buffered, called with the lock held
+    def _commit(self):
+        if not self._buffer:
+            return
+        lines = self._buffer
+        self._buffer = []
+        self._written += len(lines)
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._committed = self._written
+        self._done.notify_all()
+
+    def _flusher(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if self._closed:
+                    return
+                self._commit()
+
+    def get(self, queryNonce):
+        """
+        Latest record for a transaction.
+                Parameters:
+                    queryNonce (str): Transaction nonce
+                Returns:
+                    dict, or None if the transaction was never seen
+        """
+        return self.index.get(queryNonce)
+
+    def outcome(self, queryNonce):
+        """
+        Recorded answer to a transaction.
+                Parameters:
+                    queryNonce (str): Transaction nonce
+                Returns:
+                    True if accepted, False if denied, None if undecided or unseen
+        """
+        record = self.index.get(queryNonce)
+        if record is None or record['state'] == RECEIVED:
+            return None
+        return record['state'] == ACCEPTED
+
+    def receive(self, msg):
+        """
+        Log an incoming transact query, unless it is already known.
+                Parameters:
+                    msg (dict): Transact message
+                Returns:
+                    bool, True if the query is new
+        """
+        if msg['queryNonce'] in self.index:
+            return False
+        self._append({
+            'queryNonce': msg['queryNonce'],
+            'state': RECEIVED,
+            'player': msg.get('player_uuid') or msg.get('player'),
+            'amount': msg.get('amount'),
+            'query': msg.get('query'),
+            'time': time.time()
+        }, wait=False)
+        return True
+
+    def resolve(self, queryNonce, accept, wait=True):
+        """
+        Log the answer to a transaction, by default waiting until it is on disk.
+                Parameters:
+                    queryNonce (str): Transaction nonce
+                    accept (bool): Whether the transaction was accepted
+                    wait (bool): Block until the record is committed
+                Returns:
+                    None
+        """
+        record = self.index.get(queryNonce, {})
+        self._append({
+            'queryNonce': queryNonce,
+            'state': ACCEPTED if accept else DENIED,
+            'player': record.get('player'),
+            'amount': record.get('amount'),
+            'time': time.time()
+        }, wait)
+
+    def commit(self):
+        """
+        Force buffered records to disk.
+        """
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """
+        Commit and close the log.
+        """
+        with self._lock:
+            self._commit()
+            self._closed = True
+            self._done.notify_all()
+        self.file.close()
@@ -0,0 +1,208 @@
+from .parse import blockType, spareFuel
+
+
+def _item(item):
+    return item if ':' in item else 'minecraft:' + item
+
+
+class Message(dict):
+    """
+    Decoded frame with typed accessors. Messages are still dicts, so handlers written
+    against plain replies keep working: `msg['block']`, `msg.get('ok')`, `json.dumps(msg)`.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, dict.__repr__(self))
+
+    @property
+    def raw(self):
+        """
+        The message as a plain dict, without the typed accessors.
+        """
+        return dict(self)
+
+    @property
+    def ok(self):
+        return self.get('ok') is not False
+
+    @property
+    def error(self):
+        return self.get('error')
+
+    @property
+    def nonce(self):
+        return self.get('nonce')
+
+
+class BlockUpdate(Message):
+    """
+    A watched or polled block changed. `received` is the `time.monotonic()` it was read at.
+    """
+    __slots__ = ('received',)
+
+    def __init__(self, raw, received=None):
+        super().__init__(raw)
+        self.received = received
+
+    @property
+    def cause(self):
+        return self['cause']
+
+    @property
+    def block(self):
+        return self['block']
+
+    @property
+    def type(self):
+        return blockType(self['block'])
+
+    @property
+    def x(self):
+        return self['x']
+
+    @property
+    def y(self):
+        return self['y']
+
+    @property
+    def z(self):
+        return self['z']
+
+    @property
+    def position(self):
+        return (self['x'], self['y'], self['z'])
+
+
+class Transaction(Message):
+    """
+    A player ran a transaction command. Answer it with `accept()` or `deny()`.
+    For handlers written against the old dict, `msg['query']` is the query split into words
+    and `msg['accept']`/`msg['deny']` are the answer methods; the dict itself keeps the frame as sent.
+    """
+    __slots__ = ('client', '_query')
+
+    def __init__(self, raw, client):
+        super().__init__(raw)
+        self.client = client
+        self._query = None
+
+    def __getitem__(self, key):
+        if key == 'query':
+            return self.query
+        if key == 'accept':
+            return self.accept
+        if key == 'deny':
+            return self.deny
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in ('accept', 'deny')
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    @property
+    def queryNonce(self):
+        return self['queryNonce']
+
+    @property
+    def player(self):
+        return self.get('player')
+
+    @property
+    def amount(self):
+        return self.get('amount')
+
+    @property
+    def query(self):
+        """
+        Query split into words, split on first use.
+        """
+        if self._query is None:
+            self._query = dict.__getitem__(self, 'query').split(' ')
+        return self._query
+
+    def accept(self):
+        self.client._settle(self['queryNonce'], True)
+
+    def deny(self):
+        self.client._settle(self['queryNonce'], False)
+
+
+class BlockResponse(Message):
+    """
+    Reply to `getBlock`.
+    """
+    __slots__ = ()
+
+    @property
+    def block(self):
+        return self.get('block')
+
+    @property
+    def type(self):
+        block = self.get('block')
+        return blockType(block) if block else None
+
+
+class InventoryResponse(Message):
+    """
+    Reply to `getInventory`.
+    """
+    __slots__ = ()
+
+    @property
+    def stacks(self):
+        """
+        Item stacks in the container, each with its slot `index`, `type` and `amount`.
+        """
+        return self.get('items') or []
+
+    def slots(self, item):
+        """
+        Indexes of the slots holding an item.
+                Parameters:
+                    item (str): Item type, the `minecraft:` namespace may be omitted
+                Returns:
+                    list of int
+        """
+        item = _item(item)
+        return [stack['index'] for stack in self.stacks if stack.get('type') == item]
+
+    def count(self, item):
+        """
+        Total amount of an item in the container.
+        """
+        item = _item(item)
+        return sum(stack.get('amount', 1) for stack in self.stacks if stack.get('type') == item)
+
+
+class FuelInfo(Message):
+    """
+    Reply to `fuelInfo`.
+    """
+    __slots__ = ()
+
+    @property
+    def strategies(self):
+        return self.get('strategies') or []
+
+    @property
+    def apis(self):
+        return self.get('apis') or {}
+
+    @property
+    def spare(self):
+        """
+        Fuel left to spend across every strategy, None if the reply has no fuel figures.
+        """
+        return spareFuel(self)
+
+
+# Reply type of each read action, anything else stays a dict
+REPLIES = {
+    'get_block': BlockResponse,
+    'get_inventory': InventoryResponse,
+    'fuelinfo': FuelInfo
+}
@@ -0,0 +1,301 @@
+import queue
+import threading
+import time
+
+from .build import order
+from .fuel import FuelPlanner
+
+
+class Mirror:
+    """
+    Keeps a target structure in sync with a source structure, through two `jarci2.Client`s.
+    `copy` pipelines a bulk copy of the source onto the target; `start` then follows the source's
+    block updates and replays them on the target. Updates to the same position within `delay`
+    seconds are coalesced into one write, and writes are paced by the target's fuel.
+    Source positions map to the target shifted by `offset`.
+    """
+    def __init__(self, source, target, offset=(0, 0, 0), window=32, chunk=4096, delay=0.05,
+                 planner=None, budget=None):
+        self.source = source
+        self.target = target
+        self.offset = offset
+        self.window = window
+        self.chunk = chunk # Positions read per step of the bulk copy
+        self.delay = delay # Seconds changes are held back and coalesced before being written
+        self.planner = planner or FuelPlanner(target, window=window)
+        self.budget = budget # Most fuel per write chunk, see FuelPlanner.run
+
+        self.changes = {} # source (x, y, z) -> (blockdata, first seen), not yet written
+        self.failed = {} # source (x, y, z) -> error reply of the last failed write
+        self.retry = 1 # Seconds following waits after an error before writing again
+        self.error = None # Last error raised while following
+
+        self.applied = 0 # Writes made by following updates
+        self.coalesced = 0 # Updates replaced by a later one before being written
+        self.skipped = 0 # Updates the target already matched
+        self.errors = 0 # Errors raised while following
+        self.copied = 0 # Writes made by the bulk copy
+        self.lag = 0 # Seconds from update to write, of the last batch written
+        self.maxLag = 0
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def position(self, x, y, z):
+        """
+        Target coordinates of a source position.
+        """
+        return (x + self.offset[0], y + self.offset[1], z + self.offset[2])
+
+    def _frame(self, pos, blockdata):
+        return self.target.protocol.setBlock(*self.position(*pos), blockdata)
+
+    #
+    # Bulk copy
+    #
+
+    def _region(self, region):
+        if region is None:
+            size = self.source.getSize()
+            region = (0, 0, 0, size['x'] - 1, size['y'] - 1, size['z'] - 1)
+        x1, y1, z1, x2, y2, z2 = region
+        return [
+            (x, y, z)
+            for y in range(min(y1, y2), max(y1, y2) + 1)
+            for z in range(min(z1, z2), max(z1, z2) + 1)
+            for x in range(min(x1, x2), max(x1, x2) + 1)
+        ]
+
+    def _scan(self, client, positions):
+        replies = client.batch((client.protocol.getBlock(*pos) for pos in positions), self.window)
+        return {pos: reply['block'] for pos, reply in zip(positions, replies) if reply and 'block' in reply}
+
+    def copy(self, region=None, compare=True):
+        """
+        Copy the source onto the target, chunk by chunk. The source is read one chunk ahead
+        on a second thread while the current chunk is compared and written.
+                Parameters:
+                    region (tuple): x1, y1, z1, x2, y2, z2 of the source to copy, defaults to all of it
+                    compare (bool): Read the target first and only write blocks that differ
+                Returns:
+                    dict of failed source positions to their error replies
+                Raises:
+                    Exception: whatever stopped reading the source or writing the target
+        """
+        positions = self._region(region)
+        chunks = queue.Queue(maxsize=2)
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                for start in range(0, len(positions), self.chunk):
+                    if done.is_set():
+                        return
+                    chunk = positions[start:start + self.chunk]
+                    chunks.put((chunk, self._scan(self.source, chunk)))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                chunks.put(None)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+
+        failed = {}
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    break
+                chunk, blocks = item
+
+                current = {}
+                if compare:
+                    found = self._scan(self.target, [self.position(*pos) for pos in chunk])
+                    current = {pos: found[self.position(*pos)] for pos in chunk if self.position(*pos) in found}
+                changes = {pos: blockdata for pos, blockdata in blocks.items() if current.get(pos) != blockdata}
+
+                placements = order(changes, current)
+                written = self._write(placements)
+                failed.update(written)
+                self.copied += len(placements) - len(written)
+        finally:
+            # Stop the reader, and unblock it if it is waiting on a full queue
+            done.set()
+            while reader.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+
+        if errors:
+            raise errors[0]
+        return failed
+
+    def _write(self, placements):
+        frames = [self._frame(pos, blockdata) for pos, blockdata in placements]
+        replies = self.planner.run(frames, self.budget)
+
+        failed = {}
+        for (pos, blockdata), reply in zip(placements, replies):
+            if reply and reply.get('ok') is False:
+                failed[pos] = reply
+        self._drain()
+        return failed
+
+    # Handle whatever else the target sent, since nothing else reads its connection
+    def _drain(self):
+        while self.target.backlog:
+            received, msg = self.target.backlog.popleft()
+            self.target._dispatch(msg, self.target.protocol.receive(msg), received)
+
+    #
+    # Following updates
+    #
+
+    def start(self, region=None, compare=True):
+        """
+        Watch the source, copy it, then keep replaying its block updates on the target.
+        Both clients must be connected with `connect`; the source's event loop is run here.
+        Updates that arrive during the copy are replayed once it is done, and their lag
+        counts from when they arrived.
+                Parameters:
+                    region (tuple): Passed to `copy`
+                    compare (bool): Passed to `copy`
+                Returns:
+                    dict of positions the bulk copy failed to write
+        """
+        self.source.watchers.append(self._observe)
+        self.source.watchAll()
+
+        failed = self.copy(region, compare)
+
+        self._stopped.clear()
+        self._threads = [
+            threading.Thread(target=self._listen, daemon=True),
+            threading.Thread(target=self._follow, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return failed
+
+    def stop(self):
+        """
+        Stop following, after writing the changes already seen.
+        """
+        self._stopped.set()
+        self.source.unwatchAll()
+        self.source.disconnect()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if self._observe in self.source.watchers:
+            self.source.watchers.remove(self._observe)
+
+    def _observe(self, update):
+        self.record(update.x, update.y, update.z, update.block, update.received)
+
+    def record(self, x, y, z, blockdata, seen=None):
+        """
+        Queue a source change for the target, replacing any queued change at the same position.
+                Parameters:
+                    seen (float): `time.monotonic()` the change was received at, defaults to now
+        """
+        if seen is None:
+            seen = time.monotonic()
+        with self._lock:
+            pending = self.changes.get((x, y, z))
+            if pending:
+                self.coalesced += 1
+                self.changes[(x, y, z)] = (blockdata, min(seen, pending[1]))
+            else:
+                self.changes[(x, y, z)] = (blockdata, seen)
+
+    def _listen(self):
+        try:
+            self.source.listen()
+        except Exception:
+            # Disconnecting ends the event loop with an error
+            if not self._stopped.is_set():
+                raise
+
+    def _follow(self):
+        while True:
+            stopping = self._stopped.wait(self.delay)
+            with self._lock:
+                changes = self.changes
+                self.changes = {}
+            if changes:
+                try:
+                    self._apply(changes)
+                except Exception as error:
+                    # Keep following; the changes are tried again unless newer ones replaced them
+                    self.error = error
+                    self.errors += 1
+                    print("MIRROR ERROR:", error)
+                    self._requeue(changes)
+                    if not stopping:
+                        self._stopped.wait(self.retry)
+            if stopping:
+                return
+
+    def _requeue(self, changes):
+        with self._lock:
+            for pos, (blockdata, seen) in changes.items():
+                newer = self.changes.get(pos)
+                if newer:
+                    self.changes[pos] = (newer[0], min(seen, newer[1]))
+                else:
+                    self.changes[pos] = (blockdata, seen)
+
+    def _apply(self, changes):
+        current = {}
+        for pos in changes:
+            known = self.target.blocks.get(*self.position(*pos))
+            if known is not None:
+                current[pos] = known
+        # Changes the target already has are not written again
+        wanted = {pos: blockdata for pos, (blockdata, seen) in changes.items() if current.get(pos) != blockdata}
+        self.skipped += len(changes) - len(wanted)
+        placements = order(wanted, current)
+
+        if placements:
+            failed = self._write(placements)
+            self.failed.update(failed)
+            self.applied += len(placements) - len(failed)
+
+        now = time.monotonic()
+        self.lag = max(now - seen for blockdata, seen in changes.values())
+        self.maxLag = max(self.maxLag, self.lag)
+
+    def behind(self):
+        """
+        Age of the oldest change not yet written to the target, in seconds.
+        """
+        with self._lock:
+            if not self.changes:
+                return 0
+            return time.monotonic() - min(seen for blockdata, seen in self.changes.values())
+
+    def stats(self):
+        """
+        Replication counters and lag.
+                Returns:
+                    dict
+        """
+        return {
+            'copied': self.copied,
+            'applied': self.applied,
+            'coalesced': self.coalesced,
+            'skipped': self.skipped,
+            'failed': len(self.failed),
+            'errors': self.errors,
+            'pending': len(self.changes),
+            'lag': self.lag,
+            'maxLag': self.maxLag,
+            'behind': self.behind()
+        }
@@ -0,0 +1,111 @@
+import threading
+
+
+class Outbox:
+    """
+    Outgoing frame aggregator for a `jarci.Client` or `jarci2.Client`.
+    Frames queued within `window` seconds of each other are sent together on flush:
+    tells to the same target are joined into one message up to `limit` characters,
+    repeated sign writes to the same coordinates keep only the last text,
+    and everything else is sent unchanged, in the order it was queued.
+    """
+    def __init__(self, client, window=0.05, limit=256, separator='\n'):
+        self.client = client
+        self.window = window
+        self.limit = limit
+        self.separator = separator
+
+        self.entries = [] # [kind, key, payload], in send order
+        self.tells = {} # target -> open tell entry
+        self.signs = {} # (x, y, z) -> sign entry
+
+        self.queued = 0
+        self.sent = 0
+
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _queue(self, entry):
+        self.entries.append(entry)
+        if self._timer is None and self.window is not None:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def tell(self, target, message):
+        """
+        Queue a message to a player, merged with pending messages to the same player.
+                Parameters:
+                    target (str): Player Name or UUID
+                    message (str): Message to send to player
+                Returns:
+                    None
+        """
+        with self._lock:
+            self.queued += 1
+            entry = self.tells.get(target)
+            if entry and len(entry[2]) + len(self.separator) + len(message) <= self.limit:
+                entry[2] += self.separator + message
+                return
+            entry = ['tell', target, message]
+            self.tells[target] = entry
+            self._queue(entry)
+
+    def setSignText(self, x, y, z, lines):
+        """
+        Queue a sign write, replacing any pending write to the same sign.
+                Parameters:
+                    x (int): X coordinate
+                    y (int): Y coordinate
+                    z (int): Z coordinate
+                    lines (list): Lines to set
+                Returns:
+                    None
+        """
+        with self._lock:
+            self.queued += 1
+            entry = self.signs.get((x, y, z))
+            if entry:
+                entry[2] = lines
+                return
+            entry = ['sign', (x, y, z), lines]
+            self.signs[(x, y, z)] = entry
+            self._queue(entry)
+
+    def send(self, frame):
+        """
+        Queue any other request, sent as-is.
+                Parameters:
+                    frame (dict): Request without a nonce
+                Returns:
+                    None
+        """
+        with self._lock:
+            self.queued += 1
+            self._queue(['frame', None, frame])
+
+    def flush(self):
+        """
+        Send everything queued.
+                Returns:
+                    int, number of frames sent
+        """
+        with self._lock:
+            entries = self.entries
+            self.entries = []
+            self.tells = {}
+            self.signs = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            for kind, key, payload in entries:
+                if kind == 'tell':
+                    self.client.tell(key, payload)
+                elif kind == 'sign':
+                    self.client.setSignText(*key, payload)
+                else:
+                    self.client._send(payload)
+
+            self.sent += len(entries)
+            return len(entries)
@@ -0,0 +1,29 @@
+"""
+Field helpers shared by the messages and the engines built on them.
+Imports nothing from the package, so any module can use it.
+"""
+
+
+def blockType(blockdata):
+    """
+    Strip the block state from block data.
+            Parameters:
+                blockdata (str): Block data, e.g. minecraft:oak_stairs[facing=north]
+            Returns:
+                str
+    """
+    return blockdata.split('[', 1)[0]
+
+
+def spareFuel(info):
+    """
+    Fuel left to spend, from a fuelinfo reply: the spare fuel of every strategy added up.
+            Parameters:
+                info (dict): fuelinfo reply
+            Returns:
+                float, or None if the reply has no fuel figures
+    """
+    strategies = info.get('strategies') if info else None
+    if not strategies:
+        return None
+    return sum(strategy.get('spareFuel', 0) for strategy in strategies)
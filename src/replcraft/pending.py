@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import threading
+import time
+
+from .errors import CraftTimeout, CraftCancelled
+
+PENDING = 'pending'
+DONE = 'done'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+
+
+class Request:
+    """
+    Handle for a request waiting on its reply.
+    Timed out and cancelled requests pass an error reply to their callback,
+    {"ok": False, "error": "timeout"} or {"ok": False, "error": "cancelled"}.
+    """
+    __slots__ = ('nonce', 'deadline', 'callback', 'state', 'reply', 'owner', 'wrap', '_event')
+
+    def __init__(self, nonce, deadline=None, callback=None, owner=None, wrap=None):
+        self.nonce = nonce
+        self.deadline = deadline
+        self.callback = callback
+        self.owner = owner
+        self.wrap = wrap # Typed message class for the reply, see replcraft.messages
+        self.state = PENDING
+        self.reply = None
+        self._event = threading.Event()
+
+    @classmethod
+    def completed(cls, reply):
+        """
+        Handle for a reply that is already known, e.g. from a cache.
+        """
+        request = cls(reply.get('nonce') if reply else None)
+        request.state = DONE
+        request.reply = reply
+        request._event.set()
+        return request
+
+    def done(self):
+        return self.state != PENDING
+
+    def cancel(self):
+        """
+        Stop waiting for the reply.
+                Returns:
+                    bool, False if the request had already finished
+        """
+        if self.owner is not None:
+            return self.owner.cancel(self.nonce)
+        return self._finish(CANCELLED, {'ok': False, 'error': CANCELLED, 'nonce': self.nonce})
+
+    def wait(self, timeout=None):
+        """
+        Block until the request finishes.
+                Returns:
+                    bool, False if `timeout` passed first
+        """
+        return self._event.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Block until the reply arrives.
+                Parameters:
+                    timeout (float): Longest to wait, in seconds
+                Returns:
+                    dict
+                Raises:
+                    CraftTimeout: the request's deadline or `timeout` passed
+                    CraftCancelled: the request was cancelled
+        """
+        if not self._event.wait(timeout) or self.state == TIMEOUT:
+            raise CraftTimeout('no reply to request %s' % self.nonce)
+        if self.state == CANCELLED:
+            raise CraftCancelled('request %s was cancelled' % self.nonce)
+        return self.reply
+
+    def _finish(self, state, reply):
+        if self.state != PENDING:
+            return False
+        self.state = state
+        self.reply = reply
+        self._event.set()
+        if self.callback:
+            self.callback(reply)
+        return True
+
+
+class Pending:
+    """
+    Requests waiting on replies, by nonce. Deadlines live in a heap; finished requests are
+    removed from the nonce map right away and their heap entries skipped when they come up.
+    With `watch`, a background thread times requests out as their deadlines pass.
+    """
+    def __init__(self, watch=False):
+        self.requests = {} # nonce -> Request
+        self.deadlines = [] # heap of (deadline, sequence, Request)
+        self._seq = itertools.count()
+        self._lock = threading.Condition()
+        self._watch = watch
+        self._thread = None
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, nonce, callback=None, timeout=None, wrap=None):
+        """
+        Register a request.
+                Parameters:
+                    nonce (str): Request nonce
+                    callback (function): Called with the reply, or with an error reply
+                    timeout (float): Seconds until the request times out, None to wait forever
+                    wrap (class): Message class the reply is wrapped in, optional
+                Returns:
+                    Request
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        request = Request(nonce, deadline, callback, self, wrap)
+        with self._lock:
+            self.requests[nonce] = request
+            if deadline is not None:
+                heapq.heappush(self.deadlines, (deadline, next(self._seq), request))
+                if self._watch:
+                    self._startWatch()
+                    self._lock.notify()
+        return request
+
+    def get(self, nonce):
+        return self.requests.get(nonce)
+
+    def resolve(self, nonce, reply):
+        """
+        Hand a reply to the request it answers.
+                Returns:
+                    bool, False if no request was waiting on the nonce
+        """
+        with self._lock:
+            request = self.requests.pop(nonce, None)
+        if request is None:
+            return False
+        return request._finish(DONE, request.wrap(reply) if request.wrap else reply)
+
+    def cancel(self, nonce):
+        with self._lock:
+            request = self.requests.pop(nonce, None)
+        return request is not None and request._finish(
+            CANCELLED, {'ok': False, 'error': CANCELLED, 'nonce': nonce}
+        )
+
+    def cancelAll(self):
+        """
+        Cancel every waiting request.
+        """
+        for nonce in list(self.requests):
+            self.cancel(nonce)
+
+    def expire(self, now=None):
+        """
+        Time out every request whose deadline has passed.
+                Returns:
+                    list of the requests that timed out
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                request = heapq.heappop(self.deadlines)[2]
+                if self.requests.get(request.nonce) is request:
+                    del self.requests[request.nonce]
+                    expired.append(request)
+        for request in expired:
+            request._finish(TIMEOUT, {'ok': False, 'error': TIMEOUT, 'nonce': request.nonce})
+        return expired
+
+    def nextDeadline(self):
+        """
+        Earliest deadline still waiting, None if there is none.
+        """
+        with self._lock:
+            while self.deadlines and self.deadlines[0][2].done():
+                heapq.heappop(self.deadlines)
+            return self.deadlines[0][0] if self.deadlines else None
+
+    def _startWatch(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watcher, daemon=True)
+            self._thread.start()
+
+    def _watcher(self):
+        while True:
+            with self._lock:
+                deadline = self.nextDeadline()
+                if deadline is None or deadline > time.monotonic():
+                    self._lock.wait(None if deadline is None else deadline - time.monotonic())
+            self.expire()
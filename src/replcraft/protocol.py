@@ -0,0 +1,208 @@
+import json
+import itertools
+from base64 import b64decode
+
+from .messages import REPLIES
+from .pending import Pending
+
+# Kinds of incoming messages that are not replies to a pending request
+OPEN = 'open'
+ERROR = 'error'
+OUT_OF_FUEL = 'out of fuel'
+TRANSACT = 'transact'
+BLOCK_UPDATE = 'block update'
+EVENT = 'event'
+
+
+class Protocol:
+    """
+    Replcraft protocol state, without any IO.
+    Builds request frames and numbers them, hands replies to the pending requests they answer
+    and sorts every other incoming message into kinds for the front-end to handle.
+    """
+    def __init__(self, token, pending=None):
+        # Extract token
+        self.token = token.replace('http://', '')
+        self.config = json.loads(b64decode(token.split('.')[1] + '===='))
+
+        # Nonces are taken from a counter, so frames can be numbered from several threads
+        self._nonces = itertools.count()
+        self._last = -1
+        self.authNonce = None
+
+        # Requests waiting on a reply
+        self.pending = pending if pending is not None else Pending()
+
+    @property
+    def nonce(self):
+        """
+        Nonce the next request is expected to get.
+        """
+        return str(self._last + 1)
+
+    @property
+    def url(self):
+        return 'ws://' + self.config['host'] + '/gateway'
+
+    def prepare(self, frame):
+        """
+        Number a frame with the next nonce.
+                Parameters:
+                    frame (dict): Request
+                Returns:
+                    dict, a copy of the frame with its nonce
+        """
+        self._last = next(self._nonces)
+        frame = dict(frame, nonce=str(self._last))
+        if frame['action'] == 'authenticate':
+            self.authNonce = frame['nonce']
+        return frame
+
+    def request(self, frame, callback=None, timeout=None):
+        """
+        Number a frame and register it as waiting on a reply.
+                Parameters:
+                    frame (dict): Request
+                    callback (function): Called with the reply
+                    timeout (float): Seconds to wait for the reply
+                Returns:
+                    (dict, Request), the numbered frame and its handle
+        """
+        frame = self.prepare(frame)
+        return frame, self.pending.add(frame['nonce'], callback, timeout, REPLIES.get(frame['action']))
+
+    def decode(self, data):
+        """
+        Parse an incoming frame.
+                Returns:
+                    dict, or None for an empty frame
+        """
+        if data: # JSON cannot handle empty strings
+            return json.loads(data)
+
+    def receive(self, msg):
+        """
+        Hand a reply to the request it answers, or sort the message into kinds.
+                Parameters:
+                    msg (dict): Decoded message
+                Returns:
+                    list of kinds, empty if the message answered a pending request
+        """
+        if 'nonce' in msg and self.pending.resolve(msg['nonce'], msg):
+            return []
+
+        kinds = []
+        if msg.get('ok') is False:
+            kinds.append(OUT_OF_FUEL if msg.get('error') == 'out of fuel' else ERROR)
+        elif msg.get('nonce') is not None and msg.get('nonce') == self.authNonce:
+            kinds.append(OPEN)
+
+        if msg.get('type') in (TRANSACT, BLOCK_UPDATE):
+            kinds.append(msg['type'])
+        if msg.get('event'):
+            kinds.append(EVENT)
+        return kinds
+
+    #
+    # Request frames
+    #
+
+    def authenticate(self):
+        return {"action": "authenticate", "token": self.token}
+
+    def respond(self, queryNonce, accept):
+        return {"action": "respond", "queryNonce": queryNonce, "accept": accept}
+
+    def tell(self, target, message):
+        return {"action": "tell", "target": target, "message": message}
+
+    def pay(self, target, amount):
+        return {"action": "pay", "target": target, "amount": amount}
+
+    def getBlock(self, x, y, z):
+        return {"action": "get_block", "x": x, "y": y, "z": z}
+
+    def location(self, x, y, z):
+        return {"action": "get_location", "x": x, "y": y, "z": z}
+
+    def getSize(self):
+        return {"action": "get_size"}
+
+    def setBlock(self, x, y, z, blockdata,
+                 source_x=None, source_y=None, source_z=None,
+                 target_x=None, target_y=None, target_z=None):
+        return {
+            "action": "set_block",
+            "x": x,
+            "y": y,
+            "z": z,
+            "blockData": blockdata,
+            "source_x": source_x,
+            "source_y": source_y,
+            "source_z": source_z,
+            "target_x": target_x,
+            "target_y": target_y,
+            "target_z": target_z
+        }
+
+    def getSignText(self, x, y, z):
+        return {"action": "get_sign_text", "x": x, "y": y, "z": z}
+
+    def setSignText(self, x, y, z, lines):
+        return {"action": "set_sign_text", "x": x, "y": y, "z": z, "lines": lines}
+
+    def watch(self, x, y, z):
+        return {"action": "watch", "x": x, "y": y, "z": z}
+
+    def unwatch(self, x, y, z):
+        return {"action": "unwatch", "x": x, "y": y, "z": z}
+
+    def watchAll(self):
+        return {"action": "watch_all"}
+
+    def unwatchAll(self):
+        return {"action": "unwatch_all"}
+
+    def pollAll(self):
+        return {"action": "poll_all"}
+
+    def unpollAll(self):
+        return {"action": "unpoll_all"}
+
+    def poll(self, x, y, z):
+        return {"action": "poll", "x": x, "y": y, "z": z}
+
+    def unpoll(self, x, y, z):
+        return {"action": "unpoll", "x": x, "y": y, "z": z}
+
+    def getEntities(self):
+        return {"action": "get_entities"}
+
+    def getInventory(self, x, y, z):
+        return {"action": "get_inventory", "x": x, "y": y, "z": z}
+
+    def moveItem(self, index,
+                 source_x, source_y, source_z,
+                 target_x, target_y, target_z,
+                 amount=None, target_index=None):
+        return {
+            "action": "move_item",
+            "amount": amount,
+            "index": index,
+            "source_x": source_x,
+            "source_y": source_y,
+            "source_z": source_z,
+            "target_index": target_index,
+            "target_x": target_x,
+            "target_y": target_y,
+            "target_z": target_z
+        }
+
+    def getPowerLevel(self, x, y, z):
+        return {"action": "get_power_level", "x": x, "y": y, "z": z}
+
+    def craft(self, x, y, z, recipe):
+        return {"action": "craft", "x": x, "y": y, "z": z, "ingredients": recipe}
+
+    def fuelInfo(self):
+        return {"action": "fuelinfo"}
@@ -0,0 +1,125 @@
+import heapq
+import time
+
+
+class PowerMonitor:
+    """
+    Samples redstone power levels through a `jarci2.Client`, pipelining every point that is due
+    into one batch. A point whose level changed is sampled again after `fastest` seconds;
+    while it stays the same its interval doubles up to `slowest`.
+    Events: 'rising' and 'falling' when a point turns on or off, 'change' on any level change,
+    all called as (monitor, (x, y, z), level, previous).
+    """
+    def __init__(self, client, points=(), fastest=0.05, slowest=1, window=32):
+        self.client = client
+        self.fastest = fastest
+        self.slowest = slowest
+        self.window = window
+
+        self.levels = {} # (x, y, z) -> last power level
+        self.intervals = {} # (x, y, z) -> current sampling interval
+        self.next = {} # (x, y, z) -> time of the next sample
+        self.due = [] # heap of (time, (x, y, z)), stale entries are skipped
+
+        self.events = {}
+        self.running = False
+
+        for point in points:
+            self.add(*point)
+
+    # Events
+    def on(self, event: str):
+        def decorator(func):
+            self.events[event] = func
+            return func
+        return decorator
+
+    def _emit(self, event, *args):
+        if event in self.events:
+            self.events[event](self, *args)
+
+    def add(self, x, y, z):
+        """
+        Start monitoring a point, sampled on the next step.
+        """
+        point = (x, y, z)
+        if point in self.intervals:
+            return
+        self.intervals[point] = self.fastest
+        self._schedule(point, 0)
+
+    def _schedule(self, point, when):
+        self.next[point] = when
+        heapq.heappush(self.due, (when, point))
+
+    def _current(self, entry):
+        return self.next.get(entry[1]) == entry[0]
+
+    def remove(self, x, y, z):
+        """
+        Stop monitoring a point.
+        """
+        point = (x, y, z)
+        self.intervals.pop(point, None)
+        self.levels.pop(point, None)
+        self.next.pop(point, None)
+
+    def step(self):
+        """
+        Sample every point that is due.
+                Returns:
+                    float, seconds until the next point is due
+        """
+        now = time.monotonic()
+        points = []
+        while self.due and self.due[0][0] <= now:
+            entry = heapq.heappop(self.due)
+            if self._current(entry):
+                points.append(entry[1])
+
+        if points:
+            replies = self.client.batch(
+                ({"action": "get_power_level", "x": x, "y": y, "z": z} for x, y, z in points),
+                self.window
+            )
+            now = time.monotonic()
+            for point, reply in zip(points, replies):
+                self._sample(point, reply, now)
+
+        # Drop entries left behind by removed points
+        while self.due and not self._current(self.due[0]):
+            heapq.heappop(self.due)
+        if not self.due:
+            return self.slowest
+        return max(0, self.due[0][0] - time.monotonic())
+
+    def _sample(self, point, reply, now):
+        if point not in self.intervals:
+            return
+        level = reply.get('power') if reply else None
+        previous = self.levels.get(point)
+
+        if level is None or level == previous:
+            self.intervals[point] = min(self.slowest, self.intervals[point] * 2)
+        else:
+            self.levels[point] = level
+            self.intervals[point] = self.fastest
+            if previous is not None:
+                if not previous and level:
+                    self._emit('rising', point, level, previous)
+                elif previous and not level:
+                    self._emit('falling', point, level, previous)
+                self._emit('change', point, level, previous)
+
+        self._schedule(point, now + self.intervals[point])
+
+    def run(self):
+        """
+        Sample until `stop` is called.
+        """
+        self.running = True
+        while self.running:
+            time.sleep(self.step())
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,149 @@
+import threading
+from collections import deque
+
+INTERACTIVE = 'interactive'
+READ = 'read'
+BULK = 'bulk'
+
+# Frames sent per turn by each lane
+WEIGHTS = {INTERACTIVE: 8, READ: 4, BULK: 1}
+
+# Lane of each action, anything else goes in READ
+LANES = {
+    'authenticate': INTERACTIVE,
+    'respond': INTERACTIVE,
+    'tell': INTERACTIVE,
+    'pay': INTERACTIVE,
+    'set_block': BULK,
+    'set_sign_text': BULK,
+    'move_item': BULK,
+    'craft': BULK
+}
+
+
+class Scheduler:
+    """
+    Outbound frame scheduler with priority lanes, served by weighted round robin from a
+    background thread. Frames in a lane keep their order; a lane can be paused, resumed or
+    cancelled. Set `client.scheduler` to route a client's requests through it.
+    """
+    def __init__(self, client, weights=None):
+        self.client = client
+        self.weights = dict(weights or WEIGHTS)
+        self.lanes = {lane: deque() for lane in self.weights}
+        self.deficits = {lane: 0 for lane in self.weights}
+        self.paused = set()
+
+        self._order = list(self.weights)
+        self._turn = 0
+        self._sending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, lane=None):
+        """
+        Queue a frame for sending.
+                Parameters:
+                    frame (dict): Request, including its nonce
+                    lane (str): Lane to use, picked from the action when omitted
+        """
+        lane = lane or LANES.get(frame.get('action'), READ)
+        with self._cond:
+            self.lanes[lane].append(frame)
+            self._cond.notify_all()
+
+    def pause(self, lane):
+        """
+        Hold back a lane's frames until it is resumed.
+        """
+        with self._cond:
+            self.paused.add(lane)
+
+    def resume(self, lane):
+        with self._cond:
+            self.paused.discard(lane)
+            self._cond.notify_all()
+
+    def cancel(self, lane):
+        """
+        Drop every frame waiting in a lane. Requests waiting on a dropped frame's reply
+        are cancelled, so their callbacks get a cancelled reply and their waiters `CraftCancelled`.
+                Returns:
+                    list of the dropped frames
+        """
+        with self._cond:
+            dropped = list(self.lanes[lane])
+            self.lanes[lane].clear()
+            self.deficits[lane] = 0
+            self._cond.notify_all()
+
+        # Outside the lock, callbacks may submit more frames
+        for frame in dropped:
+            if 'nonce' in frame:
+                self.client.pending.cancel(frame['nonce'])
+        return dropped
+
+    def pending(self):
+        """
+        Number of frames waiting in each lane.
+                Returns:
+                    dict
+        """
+        with self._cond:
+            return {lane: len(frames) for lane, frames in self.lanes.items()}
+
+    def join(self):
+        """
+        Wait until every unpaused lane is empty and sent.
+        """
+        with self._cond:
+            while self._ready() or self._sending:
+                self._cond.wait()
+
+    def close(self):
+        """
+        Stop the sending thread once the unpaused lanes are drained.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _ready(self):
+        return any(frames and lane not in self.paused for lane, frames in self.lanes.items())
+
+    # Take the next turn's frames, called with the lock held
+    def _next(self):
+        while True:
+            lane = self._order[self._turn]
+            self._turn = (self._turn + 1) % len(self._order)
+            frames = self.lanes[lane]
+            if not frames or lane in self.paused:
+                self.deficits[lane] = 0
+                continue
+            self.deficits[lane] += self.weights[lane]
+            count = min(int(self.deficits[lane]), len(frames))
+            self.deficits[lane] -= count
+            if count == len(frames):
+                self.deficits[lane] = 0
+            return [frames.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready():
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                batch = self._next()
+                self._sending = len(batch)
+
+            for frame in batch:
+                self.client._write(frame)
+
+            with self._cond:
+                self._sending = 0
+                self._cond.notify_all()
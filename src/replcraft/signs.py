@@ -0,0 +1,141 @@
+import time
+
+from .fuel import FuelModel
+
+# Text that fits on a sign
+LINES = 4
+WIDTH = 15
+
+
+class SignWall:
+    """
+    Text canvas drawn on a wall of signs, `columns` signs wide and `rows` signs high.
+    The top-left sign is at `origin`; columns run along `axis` ('x' or 'z') in `direction`,
+    rows run down. Only signs whose text changed since the last flush are written,
+    at most `rate` signs per second and `budget` fuel per flush, priced by `model`
+    (a `replcraft.fuel.FuelModel`, one fuel per sign unless it has learned otherwise).
+    `client` is anything with a `setSignText`, such as a client or a `replcraft.outbox.Outbox`.
+    """
+    def __init__(self, client, origin, columns, rows, axis='x', direction=1, rate=None, budget=None,
+                 model=None):
+        self.client = client
+        self.origin = origin
+        self.columns = columns
+        self.rows = rows
+        self.axis = axis
+        self.direction = direction
+
+        self.rate = rate
+        self.budget = budget
+        self.model = model or FuelModel()
+        self._tokens = self._capacity()
+        self._last = time.monotonic()
+
+        self.canvas = [' ' * (columns * WIDTH) for _ in range(rows * LINES)]
+        self.written = {} # (column, row) -> lines last sent
+
+    @property
+    def width(self):
+        return self.columns * WIDTH
+
+    @property
+    def height(self):
+        return self.rows * LINES
+
+    def position(self, column, row):
+        """
+        Structure-local coordinates of a sign.
+                Parameters:
+                    column (int): Sign column, from the left
+                    row (int): Sign row, from the top
+                Returns:
+                    (x, y, z)
+        """
+        x, y, z = self.origin
+        offset = column * self.direction
+        if self.axis == 'x':
+            return (x + offset, y - row, z)
+        return (x, y - row, z + offset)
+
+    def write(self, line, column, text):
+        """
+        Draw text on the canvas, clipped at the edges.
+                Parameters:
+                    line (int): Text line, from the top
+                    column (int): Character column, from the left
+                    text (str): Text to draw
+        """
+        if not 0 <= line < self.height or column >= self.width:
+            return
+        if column < 0:
+            text, column = text[-column:], 0
+        text = text[:self.width - column]
+        row = self.canvas[line]
+        self.canvas[line] = row[:column] + text + row[column + len(text):]
+
+    def clear(self):
+        """
+        Blank the canvas.
+        """
+        self.canvas = [' ' * self.width for _ in range(self.height)]
+
+    def lines(self, column, row):
+        """
+        Canvas text that belongs on a sign.
+                Returns:
+                    list of str
+        """
+        start = column * WIDTH
+        return [
+            self.canvas[row * LINES + i][start:start + WIDTH].rstrip()
+            for i in range(LINES)
+        ]
+
+    def dirty(self):
+        """
+        Signs whose canvas text differs from what was last written.
+                Returns:
+                    list of (column, row)
+        """
+        return [
+            (column, row)
+            for row in range(self.rows) for column in range(self.columns)
+            if self.written.get((column, row)) != self.lines(column, row)
+        ]
+
+    # The bucket holds at least one sign, so rates below one per second still write
+    def _capacity(self):
+        return max(1, self.rate) if self.rate is not None else 0
+
+    def _allowance(self):
+        if self.rate is None:
+            return None
+        now = time.monotonic()
+        self._tokens = min(self._capacity(), self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        return int(self._tokens)
+
+    def flush(self, fuel=None):
+        """
+        Write dirty signs, within the rate limit and fuel budget. Signs left over stay dirty.
+                Parameters:
+                    fuel (float): Fuel available right now, e.g. `fuel.spareFuel(client.fuelInfo())`, optional
+                Returns:
+                    int, number of signs written
+        """
+        dirty = self.dirty()
+        cost = self.model.cost('set_sign_text')
+        budgets = [n for n in (self.budget, fuel) if n is not None]
+        affordable = int(min(budgets) // cost) if budgets and cost > 0 else None
+        limits = [n for n in (self._allowance(), affordable) if n is not None]
+        if limits:
+            dirty = dirty[:min(limits)]
+
+        for column, row in dirty:
+            lines = self.lines(column, row)
+            self.client.setSignText(*self.position(column, row), lines)
+            self.written[(column, row)] = lines
+
+        if self.rate is not None:
+            self._tokens -= len(dirty)
+        return len(dirty)
@@ -0,0 +1,108 @@
+import json
+import queue
+import select
+import socket
+import threading
+
+import websocket
+
+
+class Writer:
+    """
+    Background sender for a websocket connection.
+    Frames put from any thread are serialized and masked on the writer thread, and
+    everything queued at that moment goes out in one write, up to `batch` frames at a time.
+    At most `limit` frames wait in the queue; `put` blocks beyond that, so a
+    `replcraft.scheduler.Scheduler` feeding the writer keeps deciding what goes out next.
+    `connection` is an open `websocket.WebSocket`, such as one from `create_connection`.
+    """
+    def __init__(self, connection, batch=64, limit=None):
+        self.connection = connection
+        self.batch = batch
+
+        self.queue = queue.Queue(limit or batch)
+        self.error = None # Exception that stopped the writer, if any
+
+        self.frames = 0 # Frames sent
+        self.writes = 0 # Socket writes used to send them
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, frame):
+        """
+        Queue a frame for sending.
+                Parameters:
+                    frame (dict): Request, including its nonce
+                Raises:
+                    Exception: whatever stopped the writer, if it has stopped
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every frame queued so far is sent.
+                Returns:
+                    bool, False if the timeout ran out first
+        """
+        marker = threading.Event()
+        self.queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Send what is queued, then stop the writer thread.
+        """
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def _encode(self, frame):
+        frame = websocket.ABNF.create_frame(json.dumps(frame), websocket.ABNF.OPCODE_TEXT)
+        if self.connection.get_mask_key:
+            frame.get_mask_key = self.connection.get_mask_key
+        return frame.format()
+
+    # Readers shorten the socket timeout while they wait for replies, so a send that
+    # times out waits for the socket to become writable and carries on instead of failing
+    def _write(self, data):
+        sock = self.connection.sock
+        view = memoryview(data)
+        with self.connection.lock:
+            while view:
+                try:
+                    sent = sock.send(view)
+                except socket.timeout:
+                    select.select([], [sock], [])
+                    continue
+                view = view[sent:]
+        self.writes += 1
+
+    def _run(self):
+        closing = False
+        while not closing:
+            items = [self.queue.get()]
+            while len(items) < self.batch and not self.queue.empty():
+                items.append(self.queue.get())
+
+            data = []
+            markers = []
+            for item in items:
+                if item is None:
+                    closing = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    data.append(self._encode(item))
+
+            if data and self.error is None:
+                try:
+                    self._write(b''.join(data))
+                    self.frames += len(data)
+                except Exception as error:
+                    self.error = error
+
+            # Markers are released even after a failure, so flush never hangs
+            for marker in markers:
+                marker.set()